@@ -1,17 +1,87 @@
+import logging
+import queue
+import re
 import sqlite3
+import threading
+import zlib
+from concurrent.futures import Future
+from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Callable, Dict, Iterable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = Path(__file__).resolve().parents[3] / "data" / "app.db"
 
+# 连接参数：WAL 下读写互不阻塞，synchronous=NORMAL 只在检查点 fsync
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+# 每个连接缓存的预编译语句数
+SQLITE_CACHED_STATEMENTS = 256
 
-def get_connection() -> sqlite3.Connection:
+# 列表摘要长度
+SNIPPET_LENGTH = 160
+# email_bodies 中超过该字节数的正文用 zlib 压缩，None 表示不压缩
+BODY_COMPRESS_MIN_BYTES: Optional[int] = 1024
+# 存在 email_bodies 中、只在详情接口加载的大字段
+BODY_COLUMNS = ("body_text", "body_html", "translation")
+# 冷数据文件，和 DB_PATH 同目录，每个连接以 archive 挂载
+ARCHIVE_DB_NAME = "archive.db"
+# 归档时和 emails 一起移动的表及其关联列
+ARCHIVE_TABLES = (("emails", "id"), ("email_bodies", "email_id"), ("email_actions", "email_id"))
+# 可以归档的状态，pending/queued 的邮件始终留在热库
+ARCHIVE_STATUSES = ("sent", "deleted")
+ARCHIVE_BATCH_SIZE = 500
+
+# 写线程一次提交最多合并的写操作数
+WRITE_BATCH_SIZE = 64
+
+_local = threading.local()
+T = TypeVar("T")
+
+
+def _open_connection() -> sqlite3.Connection:
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("ATTACH DATABASE ? AS archive", (str(DB_PATH.with_name(ARCHIVE_DB_NAME)),))
+    conn.execute("PRAGMA archive.journal_mode=WAL")
+    # 归档先写 archive 再删热库，archive 的提交必须先落盘；归档写入很少，FULL 的开销可以忽略
+    conn.execute("PRAGMA archive.synchronous=FULL")
     return conn
 
 
+def get_connection() -> sqlite3.Connection:
+    """当前线程的持久连接，首次使用时打开；调用方不要关闭它"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection()
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+
+def close_connection() -> None:
+    """关闭当前线程的连接"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
 def init_db() -> None:
     conn = get_connection()
     cursor = conn.cursor()
@@ -37,6 +107,7 @@ def init_db() -> None:
             username TEXT,
             password TEXT,
             use_ssl INTEGER DEFAULT 1,
+            fetch_interval INTEGER,
             updated_at TEXT
         )
         """
@@ -73,10 +144,13 @@ def init_db() -> None:
         CREATE TABLE IF NOT EXISTS emails (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             message_id TEXT UNIQUE,
+            account_id INTEGER,
             sender TEXT,
             subject TEXT,
             body_text TEXT,
             body_html TEXT,
+            snippet TEXT,
+            attachments TEXT,
             received_at TEXT,
             language TEXT,
             translation TEXT,
@@ -106,9 +180,258 @@ def init_db() -> None:
         """
     )
 
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mail_sync_state (
+            account_id INTEGER NOT NULL,
+            folder TEXT NOT NULL,
+            uidvalidity INTEGER,
+            last_uid INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY(account_id, folder),
+            FOREIGN KEY(account_id) REFERENCES mail_accounts(id)
+        )
+        """
+    )
+
+    # 待发送的回复，由后台投递任务发送并重试
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email_id INTEGER,
+            account_id INTEGER,
+            to_addr TEXT NOT NULL,
+            subject TEXT,
+            body TEXT,
+            category_id INTEGER,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TEXT,
+            last_error TEXT,
+            smtp_response TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            FOREIGN KEY(email_id) REFERENCES emails(id)
+        )
+        """
+    )
+
     conn.commit()
+    run_migrations(conn)
+    init_archive(conn)
     seed_defaults(conn)
-    conn.close()
+
+
+def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, ddl: str) -> None:
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _migrate_add_columns(cursor: sqlite3.Cursor) -> None:
+    """旧库补齐后加的列"""
+    _ensure_column(cursor, "mail_accounts", "fetch_interval", "INTEGER")
+    _ensure_column(cursor, "emails", "account_id", "INTEGER")
+    _ensure_column(cursor, "emails", "attachments", "TEXT")
+
+
+def _migrate_hot_path_indexes(cursor: sqlite3.Cursor) -> None:
+    """常用查询的索引：收件箱列表、模板查找、email_actions 关联、发件箱调度"""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_status_received ON emails(status, received_at DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_received ON emails(received_at DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_templates_category ON templates(category_id, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_email_actions_email ON email_actions(email_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_email ON outbox(email_id)")
+
+
+def _migrate_email_counters(cursor: sqlite3.Cursor) -> None:
+    """按状态计数的 email_counters 表，由触发器维护；收件箱列表的键集分页索引"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_counters (
+            status TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    cursor.execute("DELETE FROM email_counters")
+    cursor.execute(
+        "INSERT INTO email_counters (status, count) SELECT COALESCE(status, ''), COUNT(*) FROM emails GROUP BY COALESCE(status, '')"
+    )
+    # executescript 会先提交当前事务，触发器逐条创建
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_count_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO email_counters (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_count_delete AFTER DELETE ON emails BEGIN
+            UPDATE email_counters SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_count_update AFTER UPDATE OF status ON emails
+        WHEN COALESCE(OLD.status, '') != COALESCE(NEW.status, '') BEGIN
+            UPDATE email_counters SET count = count - 1 WHERE status = COALESCE(OLD.status, '');
+            INSERT INTO email_counters (status, count) VALUES (COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(status) DO UPDATE SET count = count + 1;
+        END
+        """
+    )
+    # 键集分页按 (received_at, id) 排序，替换迁移 2 的两个索引
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_status_received_id ON emails(status, received_at DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_emails_received_id ON emails(received_at DESC, id DESC)")
+    cursor.execute("DROP INDEX IF EXISTS idx_emails_status_received")
+    cursor.execute("DROP INDEX IF EXISTS idx_emails_received")
+
+
+def _migrate_email_bodies(cursor: sqlite3.Cursor) -> None:
+    """正文等大字段移到 email_bodies，emails 只保留列表需要的列和摘要"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_bodies (
+            email_id INTEGER PRIMARY KEY,
+            codec TEXT NOT NULL DEFAULT '',
+            body_text BLOB,
+            body_html BLOB,
+            translation BLOB,
+            FOREIGN KEY(email_id) REFERENCES emails(id)
+        )
+        """
+    )
+    _ensure_column(cursor, "emails", "snippet", "TEXT")
+    cursor.execute(
+        """
+        INSERT OR IGNORE INTO email_bodies (email_id, codec, body_text, body_html, translation)
+        SELECT id, '', body_text, body_html, translation FROM emails
+        WHERE body_text IS NOT NULL OR body_html IS NOT NULL OR translation IS NOT NULL
+        """
+    )
+    cursor.execute(
+        f"""
+        UPDATE emails SET snippet = substr(trim(body_text), 1, {SNIPPET_LENGTH}),
+            body_text = NULL, body_html = NULL, translation = NULL
+        WHERE body_text IS NOT NULL OR body_html IS NOT NULL OR translation IS NOT NULL
+        """
+    )
+
+
+def _migrate_email_fts(cursor: sqlite3.Cursor) -> None:
+    """
+    全文检索表 emails_fts，rowid 即 emails.id。
+    trigram 分词可以检索中文和订单号片段；SQLite 不支持时退回 unicode61，没有 FTS5 时跳过（搜索退回 LIKE）。
+    主题、发件人、最终回复由触发器同步；正文在 email_bodies 中可能是压缩的，由 _put_bodies 写入。
+    """
+    for tokenizer in ("trigram", "unicode61"):
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5("
+                f"subject, sender, body_text, translation, final_reply, tokenize='{tokenizer}')"
+            )
+            break
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 tokenizer {tokenizer} unavailable: {e}")
+    else:
+        return
+
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_fts_insert AFTER INSERT ON emails BEGIN
+            INSERT INTO emails_fts (rowid, subject, sender, final_reply)
+            VALUES (NEW.id, NEW.subject, NEW.sender, NEW.final_reply);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_fts_update AFTER UPDATE OF subject, sender, final_reply ON emails BEGIN
+            UPDATE emails_fts SET subject = NEW.subject, sender = NEW.sender, final_reply = NEW.final_reply
+            WHERE rowid = NEW.id;
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_emails_fts_delete AFTER DELETE ON emails BEGIN
+            DELETE FROM emails_fts WHERE rowid = OLD.id;
+        END
+        """
+    )
+    cursor.execute(
+        "INSERT INTO emails_fts (rowid, subject, sender, final_reply) SELECT id, subject, sender, final_reply FROM emails"
+    )
+    bodies = cursor.execute("SELECT * FROM email_bodies").fetchall()
+    cursor.executemany(
+        "UPDATE emails_fts SET body_text = ?, translation = ? WHERE rowid = ?",
+        [
+            (_unpack_body(body["codec"], body["body_text"]), _unpack_body(body["codec"], body["translation"]), body["email_id"])
+            for body in bodies
+        ],
+    )
+
+
+# 按顺序执行的迁移，第 n 个迁移完成后 PRAGMA user_version = n。
+# 只能在末尾追加，不要修改或删除已发布的迁移。
+MIGRATIONS = [
+    _migrate_add_columns,
+    _migrate_hot_path_indexes,
+    _migrate_email_counters,
+    _migrate_email_bodies,
+    _migrate_email_fts,
+]
+
+
+def run_migrations(conn: sqlite3.Connection) -> None:
+    """执行尚未应用的迁移，每个迁移和版本号更新在同一个事务里"""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in enumerate(MIGRATIONS, 1):
+        if version <= current:
+            continue
+        conn.execute("BEGIN")
+        try:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied database migration {version}: {migration.__name__}")
+
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [column["name"] for column in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def init_archive(conn: sqlite3.Connection) -> None:
+    """
+    按 main 中的表结构在 archive 中建表（含 emails_fts），已存在的表补齐迁移后新增的列。
+    archive 只由 archive_emails 写入，不需要触发器和计数表。
+    """
+    for table in (*(name for name, _ in ARCHIVE_TABLES), "emails_fts"):
+        row = conn.execute("SELECT sql FROM main.sqlite_master WHERE name = ?", (table,)).fetchone()
+        if not row:
+            continue
+        if not conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name = ?", (table,)).fetchone():
+            conn.execute(re.sub(rf"\b{table}\b", f"archive.{table}", row["sql"], count=1))
+            continue
+        if table == "emails_fts":
+            continue
+        archived = set(_table_columns(conn, "archive", table))
+        for column in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+            if column["name"] in archived:
+                continue
+            default = f" DEFAULT {column['dflt_value']}" if column["dflt_value"] is not None else ""
+            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column['name']} {column['type']}{default}")
+    conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_email_actions_email ON email_actions(email_id)")
+    conn.commit()
 
 
 def seed_defaults(conn: sqlite3.Connection) -> None:
@@ -127,35 +450,454 @@ def seed_defaults(conn: sqlite3.Connection) -> None:
 
 
 def fetch_one(query: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
-    conn = get_connection()
-    cur = conn.execute(query, params)
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return get_connection().execute(query, params).fetchone()
 
 
 def fetch_all(query: str, params: Iterable[Any] = ()) -> list[sqlite3.Row]:
-    conn = get_connection()
-    cur = conn.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
-    return list(rows)
+    return get_connection().execute(query, params).fetchall()
+
+
+class _Writer:
+    """
+    唯一的写连接。
+    所有写操作排队交给写线程执行，队列里已有的操作合并成一个事务提交，每个操作一个 SAVEPOINT，
+    出错只回滚它自己；提交之后才通过 Future 把结果或异常交给调用方。读操作用各线程自己的连接。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._queue: Optional[queue.SimpleQueue] = None
+
+    def on_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="sqlite-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((fn, future))
+        return future
+
+    def stop(self) -> None:
+        """处理完已入队的写操作后退出写线程；之后再有写入会重新启动"""
+        with self._lock:
+            thread, ops = self._thread, self._queue
+            self._thread = self._queue = None
+        if thread is not None:
+            ops.put(None)
+            thread.join()
+
+    def _run(self, ops: queue.SimpleQueue) -> None:
+        try:
+            while True:
+                item = ops.get()
+                if item is None:
+                    return
+                batch = [item]
+                stopping = False
+                while len(batch) < WRITE_BATCH_SIZE:
+                    try:
+                        item = ops.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    batch.append(item)
+                self._commit(batch)
+                if stopping:
+                    return
+        finally:
+            close_connection()
+
+    @staticmethod
+    def _commit(batch: list) -> None:
+        conn = get_connection()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    results.append((future, fn(conn), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    results.append((future, None, e))
+                conn.execute("RELEASE write_op")
+            conn.commit()
+        except Exception as e:
+            # BEGIN/COMMIT 失败（磁盘满等）时整批回滚，所有调用方都收到该异常
+            logger.error(f"SQLite write batch of {len(batch)} failed: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_writer = _Writer()
+
+
+def write(fn: Callable[[sqlite3.Connection], T]) -> T:
+    """
+    在写线程上执行 fn(conn)，等提交后返回 fn 的结果；fn 抛出的异常原样抛给调用方，其写入被回滚。
+    在写线程内调用（嵌套写入）时直接执行，随外层操作一起提交。
+    """
+    if _writer.on_writer_thread():
+        return fn(get_connection())
+    return _writer.submit(fn).result()
+
+
+def submit_write(fn: Callable[[sqlite3.Connection], T]) -> "Future[T]":
+    """同 write，但不等待，返回 Future；协程里可以 await asyncio.wrap_future(...)"""
+    if _writer.on_writer_thread():
+        future: Future = Future()
+        future.set_result(fn(get_connection()))
+        return future
+    return _writer.submit(fn)
+
+
+def stop_writer() -> None:
+    _writer.stop()
 
 
 def execute(query: str, params: Iterable[Any] = ()) -> int:
-    conn = get_connection()
-    cur = conn.execute(query, params)
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
-    return last_id
+    return write(lambda conn: conn.execute(query, params).lastrowid)
 
 
 def execute_many(query: str, params_list: Iterable[Iterable[Any]]) -> None:
+    write(lambda conn: conn.executemany(query, params_list))
+
+
+def existing_message_ids(message_ids: list[str]) -> set[str]:
+    """批量查询已入库的 message_id（包括软删除和已归档的邮件）"""
+    found = set()
+    for i in range(0, len(message_ids), 500):
+        chunk = message_ids[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        rows = fetch_all(
+            f"SELECT message_id FROM main.emails WHERE message_id IN ({placeholders}) "
+            f"UNION SELECT message_id FROM archive.emails WHERE message_id IN ({placeholders})",
+            chunk + chunk,
+        )
+        found.update(row["message_id"] for row in rows)
+    return found
+
+
+# 入库时写入的列，insert_emails 的每一行按此顺序取值
+EMAIL_INSERT_COLUMNS = (
+    "message_id",
+    "account_id",
+    "sender",
+    "subject",
+    "snippet",
+    "attachments",
+    "received_at",
+    "language",
+    "status",
+    "category_id",
+    "confidence",
+    "ai_reply",
+    "created_at",
+)
+# 单条 INSERT 的最大行数，避免超过 SQLite 的绑定参数上限
+_INSERT_CHUNK_ROWS = 500
+
+
+def make_snippet(text: Optional[str]) -> str:
+    return " ".join((text or "").split())[:SNIPPET_LENGTH]
+
+
+def _pack_body(values: list[Optional[str]]) -> tuple[str, list[Any]]:
+    """返回 (codec, 各列取值)；整行超过阈值时各列分别 zlib 压缩"""
+    size = sum(len(value) for value in values if value)
+    if BODY_COMPRESS_MIN_BYTES is None or size < BODY_COMPRESS_MIN_BYTES:
+        return "", list(values)
+    return "zlib", [zlib.compress(value.encode("utf-8")) if value is not None else None for value in values]
+
+
+def _unpack_body(codec: str, value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if codec == "zlib":
+        return zlib.decompress(value).decode("utf-8")
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _put_bodies(conn: sqlite3.Connection, items: list[tuple[int, dict]]) -> None:
+    params = []
+    for email_id, row in items:
+        codec, values = _pack_body([row.get(column) for column in BODY_COLUMNS])
+        params.append((email_id, codec, *values))
+    conn.executemany(
+        f"INSERT OR REPLACE INTO email_bodies (email_id, codec, {', '.join(BODY_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+        params,
+    )
+    if has_fts(conn):
+        conn.executemany(
+            "UPDATE emails_fts SET body_text = ?, translation = ? WHERE rowid = ?",
+            [(row.get("body_text"), row.get("translation"), email_id) for email_id, row in items],
+        )
+
+
+def has_fts(conn: Optional[sqlite3.Connection] = None, schema: str = "main") -> bool:
+    conn = conn or get_connection()
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = 'emails_fts'").fetchone() is not None
+
+
+# emails_fts 中参与检索的列
+FTS_COLUMNS = ("subject", "sender", "body_text", "translation", "final_reply")
+
+
+def _like_pattern(text: str) -> str:
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _fts_query(text: str) -> tuple[Optional[str], list[str]]:
+    """
+    把用户输入拆成 (FTS5 MATCH 查询, 短词)，所有词都要匹配。
+    3 个字符及以上的词作为短语交给 MATCH；trigram 匹配不到更短的词（中文词多为两个字），
+    这些词在 FTS 各列上按 LIKE 过滤。
+    """
+    terms = text.split()
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3]
+    return (" ".join(phrases) or None), [term for term in terms if len(term) < 3]
+
+
+def search_emails(text: str, status: Optional[str] = None, limit: int = 20, offset: int = 0) -> list[Dict[str, Any]]:
+    """
+    全文检索，热库和 archive 一起查，按 bm25 相关度排序，highlight 为命中片段（<mark> 标注）。
+    只有短词时在 FTS 表上按 LIKE 过滤，按收信时间排序；没有 FTS5 时退回 LIKE 扫描主题、发件人和摘要。
+    """
+    status_filter, status_params = ("AND e.status = ?", [status]) if status else ("", [])
+    columns = (
+        "e.id, e.message_id, e.account_id, e.sender, e.subject, e.snippet, e.received_at, "
+        "e.language, e.status, e.category_id, e.confidence, e.created_at"
+    )
+    query, short_terms = _fts_query(text)
     conn = get_connection()
-    conn.executemany(query, params_list)
-    conn.commit()
-    conn.close()
+    schemas = [schema for schema in ("main", "archive") if has_fts(conn, schema)] if query or short_terms else []
+    selects, params = [], []
+    if schemas:
+        conditions, condition_params = [], []
+        if query:
+            conditions.append("emails_fts MATCH ?")
+            condition_params.append(query)
+        for term in short_terms:
+            conditions.append("(" + " OR ".join(f"emails_fts.{column} LIKE ? ESCAPE '\\'" for column in FTS_COLUMNS) + ")")
+            condition_params += [_like_pattern(term)] * len(FTS_COLUMNS)
+        # snippet() 和 bm25() 只能用于 MATCH 查询
+        ranking = (
+            "snippet(emails_fts, -1, '<mark>', '</mark>', '…', 16) AS highlight, bm25(emails_fts) AS score"
+            if query else "e.snippet AS highlight"
+        )
+        for schema in schemas:
+            selects.append(
+                f"""
+                SELECT {columns}, {ranking}
+                FROM {schema}.emails_fts JOIN {schema}.emails e ON e.id = emails_fts.rowid
+                WHERE {' AND '.join(conditions)} {status_filter}
+                """
+            )
+            params += [*condition_params, *status_params]
+        order = "score" if query else "received_at DESC, id DESC"
+    else:
+        pattern = _like_pattern(text.strip())
+        for schema in ("main", "archive"):
+            selects.append(
+                f"""
+                SELECT {columns}, e.snippet AS highlight
+                FROM {schema}.emails e
+                WHERE (e.subject LIKE ? ESCAPE '\\' OR e.sender LIKE ? ESCAPE '\\' OR e.snippet LIKE ? ESCAPE '\\') {status_filter}
+                """
+            )
+            params += [pattern, pattern, pattern, *status_params]
+        order = "received_at DESC, id DESC"
+    rows = fetch_all(
+        f"SELECT * FROM ({' UNION ALL '.join(selects)}) ORDER BY {order} LIMIT ? OFFSET ?",
+        (*params, limit, offset),
+    )
+    results = []
+    for row in rows:
+        item = dict(row)
+        item.pop("score", None)
+        results.append(item)
+    return results
+
+
+def insert_emails(rows: list[dict]) -> dict[Optional[str], int]:
+    """
+    在一个写操作里批量插入邮件，message_id 已存在的行跳过。
+    body_text、body_html、translation 写入 email_bodies，emails 只存摘要。
+    返回: {message_id: 新行 id}
+    """
+    inserted: dict[Optional[str], int] = {}
+    if not rows:
+        return inserted
+    for row in rows:
+        row.setdefault("snippet", make_snippet(row.get("body_text")))
+    columns = ", ".join(EMAIL_INSERT_COLUMNS)
+    row_placeholder = "(" + ",".join("?" * len(EMAIL_INSERT_COLUMNS)) + ")"
+    bodies: list[tuple[int, dict]] = []
+    def store(conn: sqlite3.Connection) -> None:
+        # 没有 message_id 的行无法按 RETURNING 结果对应，和旧版 SQLite（< 3.35，没有 RETURNING）一样逐行插入
+        legacy = sqlite3.sqlite_version_info < (3, 35, 0)
+        per_row = rows if legacy else [row for row in rows if not row.get("message_id")]
+        keyed = [] if legacy else [row for row in rows if row.get("message_id")]
+        for row in per_row:
+            cur = conn.execute(
+                f"INSERT OR IGNORE INTO emails ({columns}) VALUES {row_placeholder}",
+                [row.get(column) for column in EMAIL_INSERT_COLUMNS],
+            )
+            if cur.rowcount:
+                inserted[row.get("message_id")] = cur.lastrowid
+                bodies.append((cur.lastrowid, row))
+
+        for i in range(0, len(keyed), _INSERT_CHUNK_ROWS):
+            chunk = keyed[i:i + _INSERT_CHUNK_ROWS]
+            by_message_id: dict[str, dict] = {}
+            for row in chunk:
+                by_message_id.setdefault(row["message_id"], row)
+            params = [row.get(column) for row in chunk for column in EMAIL_INSERT_COLUMNS]
+            cur = conn.execute(
+                f"INSERT INTO emails ({columns}) VALUES {','.join([row_placeholder] * len(chunk))} "
+                "ON CONFLICT(message_id) DO NOTHING RETURNING id, message_id",
+                params,
+            )
+            for email_id, message_id in cur.fetchall():
+                inserted[message_id] = email_id
+                bodies.append((email_id, by_message_id[message_id]))
+
+        _put_bodies(conn, bodies)
+
+    write(store)
+    return inserted
+
+
+def load_email(email_id: int) -> Optional[Dict[str, Any]]:
+    """邮件详情：emails 行加上 email_bodies 中的正文和译文；热库没有时查 archive，archived 标记来源"""
+    for schema in ("main", "archive"):
+        row = fetch_one(f"SELECT * FROM {schema}.emails WHERE id = ?", (email_id,))
+        if row:
+            break
+    else:
+        return None
+    email_row = dict(row)
+    email_row["archived"] = schema == "archive"
+    body = fetch_one(f"SELECT * FROM {schema}.email_bodies WHERE email_id = ?", (email_id,))
+    if body:
+        for column in BODY_COLUMNS:
+            email_row[column] = _unpack_body(body["codec"], body[column])
+    return email_row
+
+
+def archive_emails(before: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    把 received_at 早于 before 的已发送、已删除邮件连同正文、处理记录和索引移到 archive，返回移动的封数。
+    WAL 模式下跨库事务不是原子提交的，所以每批分两次写入：先复制到 archive 并提交（archive 为 synchronous=FULL），
+    再从热库删除 archive.emails 中确认存在的行。中途崩溃时最多在 archive 留下副本，下次归档用 INSERT OR REPLACE 覆盖，不会丢数据。
+    从 emails 删除时触发器同步更新计数和热库 emails_fts。
+    """
+    statuses = ",".join("?" * len(ARCHIVE_STATUSES))
+    fts = has_fts() and has_fts(schema="archive")
+
+    def copy_batch(conn: sqlite3.Connection) -> list[int]:
+        ids = [
+            row["id"]
+            for row in conn.execute(
+                f"SELECT id FROM main.emails WHERE status IN ({statuses}) AND received_at < ? ORDER BY id LIMIT ?",
+                (*ARCHIVE_STATUSES, before, batch_size),
+            )
+        ]
+        if not ids:
+            return ids
+        placeholders = ",".join("?" * len(ids))
+        for table, key in ARCHIVE_TABLES:
+            columns = ", ".join(_table_columns(conn, "main", table))
+            conn.execute(
+                f"INSERT OR REPLACE INTO archive.{table} ({columns}) "
+                f"SELECT {columns} FROM main.{table} WHERE {key} IN ({placeholders})",
+                ids,
+            )
+        if fts:
+            conn.execute(f"DELETE FROM archive.emails_fts WHERE rowid IN ({placeholders})", ids)
+            conn.execute(
+                "INSERT INTO archive.emails_fts (rowid, subject, sender, body_text, translation, final_reply) "
+                "SELECT rowid, subject, sender, body_text, translation, final_reply "
+                f"FROM main.emails_fts WHERE rowid IN ({placeholders})",
+                ids,
+            )
+        return ids
+
+    def delete_batch(conn: sqlite3.Connection, ids: list[int]) -> int:
+        placeholders = ",".join("?" * len(ids))
+        confirmed = [
+            row["id"] for row in conn.execute(f"SELECT id FROM archive.emails WHERE id IN ({placeholders})", ids)
+        ]
+        if not confirmed:
+            return 0
+        placeholders = ",".join("?" * len(confirmed))
+        for table, key in reversed(ARCHIVE_TABLES):
+            conn.execute(f"DELETE FROM main.{table} WHERE {key} IN ({placeholders})", confirmed)
+        return len(confirmed)
+
+    moved = 0
+    while True:
+        ids = write(copy_batch)
+        if not ids:
+            return moved
+        count = write(lambda conn: delete_batch(conn, ids))
+        if not count:
+            # 复制后在 archive 中查不到，说明写入 archive 失败，停止本轮避免反复复制
+            logger.error(f"Archived copy of {len(ids)} email(s) not found, keeping them in the hot database")
+            return moved
+        moved += count
+
+
+def classified_emails(after_action_id: int = 0, limit: int = 1000) -> list[Dict[str, Any]]:
+    """
+    已成功发送回复的邮件及客服最终确认的分类，按 email_actions.id 递增（包括已归档的邮件），用于训练本地分类模型。
+    返回: [{"action_id", "category_id", "text"}]，text 与分类时使用的文本一致（正文，没有正文时用主题）
+    """
+    selects = [
+        f"""
+        SELECT a.id AS action_id, a.final_category_id AS category_id, e.subject, b.codec, b.body_text
+        FROM {schema}.email_actions a
+        JOIN {schema}.emails e ON e.id = a.email_id
+        LEFT JOIN {schema}.email_bodies b ON b.email_id = e.id
+        WHERE a.id > ? AND a.sent_at IS NOT NULL AND a.final_category_id IS NOT NULL
+        """
+        for schema in ("main", "archive")
+    ]
+    rows = fetch_all(
+        f"SELECT * FROM ({' UNION ALL '.join(selects)}) ORDER BY action_id LIMIT ?",
+        (after_action_id, after_action_id, limit),
+    )
+    return [
+        {
+            "action_id": row["action_id"],
+            "category_id": row["category_id"],
+            "text": _unpack_body(row["codec"], row["body_text"]) or row["subject"] or "",
+        }
+        for row in rows
+    ]
+
+
+def email_counts() -> Dict[str, int]:
+    """各状态的邮件数，读 email_counters 表，不扫描 emails"""
+    return {row["status"]: row["count"] for row in fetch_all("SELECT status, count FROM email_counters")}
 
 
 def set_setting(key: str, value: str) -> None:
@@ -173,3 +915,91 @@ def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
 def get_settings() -> Dict[str, str]:
     rows = fetch_all("SELECT key, value FROM settings")
     return {row["key"]: row["value"] for row in rows}
+
+
+def list_mail_accounts() -> list[sqlite3.Row]:
+    """所有邮箱账号；同一邮箱保存过多次时只取最新一条"""
+    return fetch_all(
+        "SELECT * FROM mail_accounts WHERE id IN (SELECT MAX(id) FROM mail_accounts GROUP BY email) ORDER BY id"
+    )
+
+
+def get_mail_account(account_id: Optional[int] = None) -> Optional[sqlite3.Row]:
+    """
+    按 ID 取账号，账号已删除时返回 None，不能改用其他账号发信。
+    只有未指定 ID（多账号之前的旧数据）时才回退到最近更新的账号。
+    """
+    if account_id is not None:
+        return fetch_one("SELECT * FROM mail_accounts WHERE id = ?", (account_id,))
+    return fetch_one("SELECT * FROM mail_accounts ORDER BY updated_at DESC LIMIT 1")
+
+
+def get_sync_state(account_id: int, folder: str = "INBOX") -> Optional[sqlite3.Row]:
+    return fetch_one(
+        "SELECT uidvalidity, last_uid FROM mail_sync_state WHERE account_id = ? AND folder = ?",
+        (account_id, folder),
+    )
+
+
+def set_sync_state(account_id: int, folder: str, uidvalidity: int, last_uid: int) -> None:
+    execute(
+        """
+        INSERT INTO mail_sync_state (account_id, folder, uidvalidity, last_uid, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(account_id, folder) DO UPDATE SET
+            uidvalidity = excluded.uidvalidity,
+            last_uid = excluded.last_uid,
+            updated_at = excluded.updated_at
+        """,
+        (account_id, folder, uidvalidity, last_uid, datetime.utcnow().isoformat()),
+    )
+
+
+def enqueue_outbox(
+    email_id: Optional[int],
+    account_id: Optional[int],
+    to_addr: str,
+    subject: str,
+    body: str,
+    category_id: Optional[int] = None,
+    conn: Optional[sqlite3.Connection] = None,
+) -> int:
+    """写入发件箱；传入 conn 时在调用方的事务里执行，不单独提交"""
+    now = datetime.utcnow().isoformat()
+    query = """
+        INSERT INTO outbox
+        (email_id, account_id, to_addr, subject, body, category_id, status, attempts, next_attempt_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?, ?)
+        """
+    params = (email_id, account_id, to_addr, subject, body, category_id, now, now, now)
+    if conn is not None:
+        return conn.execute(query, params).lastrowid
+    return execute(query, params)
+
+
+def claim_outbox(limit: int = 100) -> list[sqlite3.Row]:
+    """取出到期的待发送邮件并标记为 sending，同一封不会被重复取出"""
+    now = datetime.utcnow().isoformat()
+
+    def claim(conn: sqlite3.Connection) -> list[sqlite3.Row]:
+        rows = conn.execute(
+            "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+            (now, limit),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+            [(now, row["id"]) for row in rows],
+        )
+        return list(rows)
+
+    return write(claim)
+
+
+def reset_stale_outbox() -> int:
+    """进程退出时正在发送的邮件重新排队（可能重复发送一次，但不会丢失）"""
+    return write(
+        lambda conn: conn.execute(
+            "UPDATE outbox SET status = 'pending', updated_at = ? WHERE status = 'sending'",
+            (datetime.utcnow().isoformat(),),
+        ).rowcount
+    )
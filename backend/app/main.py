@@ -1,4 +1,5 @@
 import asyncio
+import json
 import logging
 import webbrowser
 from pathlib import Path
@@ -9,7 +10,12 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from .db import db
 from .routes import categories, emails, settings, templates
-from .scheduler.poller import EmailPoller
+from .scheduler.outbox import outbox_worker
+from .scheduler.poller import email_poller
+from .scheduler.retention import retention_job
+from .services import mime_parser
+from .services.local_classifier import local_classifier
+from .services.smtp_pool import smtp_pool
 
 # 配置日志
 logging.basicConfig(
@@ -40,19 +46,28 @@ static_dir = Path(__file__).resolve().parents[2] / "frontend" / "dist"
 if static_dir.exists():
     app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
 
-poller = EmailPoller()
-
-
 @app.on_event("startup")
 async def startup_event() -> None:
     logger.info("Starting application...")
     db.init_db()
+    smtp_pool.rate_limiter.configure(json.loads(db.get_setting("smtp_rate_limits", "") or "{}"))
     interval = int(db.get_setting("fetch_interval", "300"))
-    await poller.start(interval)
-    logger.info(f"Email poller started with interval {interval}s")
+    mode = db.get_setting("fetch_mode", "interval")
+    await email_poller.start(interval, mode)
+    logger.info(f"Email poller started with interval {interval}s (mode: {mode})")
+    await outbox_worker.start()
+    await retention_job.start()
+    # 从历史处理记录训练本地分类模型，不阻塞启动
+    asyncio.get_event_loop().run_in_executor(None, local_classifier.refresh)
     asyncio.get_event_loop().call_later(1.0, lambda: webbrowser.open("http://127.0.0.1:8001"))
 
 
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
-    await poller.stop()
+    await email_poller.stop()
+    await outbox_worker.stop()
+    await retention_job.stop()
+    smtp_pool.close_all()
+    mime_parser.shutdown()
+    db.stop_writer()
+    db.close_connection()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
 from ..db import db
+from ..services.config_cache import config_cache
 
 router = APIRouter(prefix="/api/categories", tags=["categories"])
 
@@ -26,6 +27,7 @@ def create_category(payload: CategoryRequest):
         "INSERT INTO categories (name, description, keywords, is_default, priority) VALUES (?, ?, ?, ?, ?)",
         (payload.name, payload.description, payload.keywords, int(payload.is_default), payload.priority),
     )
+    config_cache.bump()
     return {"id": category_id}
 
 
@@ -35,6 +37,7 @@ def update_category(category_id: int, payload: CategoryRequest):
         "UPDATE categories SET name = ?, description = ?, keywords = ?, is_default = ?, priority = ? WHERE id = ?",
         (payload.name, payload.description, payload.keywords, int(payload.is_default), payload.priority, category_id),
     )
+    config_cache.bump()
     return {"status": "ok"}
 
 
@@ -44,4 +47,5 @@ def delete_category(category_id: int):
     if not existing:
         raise HTTPException(status_code=404, detail="Category not found")
     db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+    config_cache.bump()
     return {"status": "deleted"}
@@ -1,13 +1,18 @@
-from datetime import datetime
-from typing import Optional
+import asyncio
+import base64
+import json
+from typing import List, Optional
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
 from ..db import db
+from ..scheduler.outbox import outbox_worker
+from ..scheduler.poller import email_poller
 from ..services.classifier import classify_email
+from ..services.config_cache import config_cache
+from ..services.local_classifier import DEFAULT_THRESHOLD as LOCAL_CLASSIFIER_THRESHOLD
 from ..services.ai_client import generate_reply_ai
-from ..services.email_client import send_reply
 from ..services.template_engine import render_template, build_variables
 from ..services.translator import translate_baidu
 from ..services.test_email_generator import generateTestEmails
@@ -20,6 +25,12 @@ class EmailSendRequest(BaseModel):
     category_id: Optional[int] = None
 
 
+class BatchSendItem(BaseModel):
+    email_id: int
+    reply: Optional[str] = None  # 为空时发送已生成的 ai_reply
+    category_id: Optional[int] = None
+
+
 class AnalyzeRequest(BaseModel):
     force_ai: bool = False
 
@@ -30,65 +41,109 @@ class TranslateRequest(BaseModel):
     source_lang: str = "auto"  # 源语言，默认自动检测
 
 
+# 列表只返回这些列，正文等大字段通过 GET /api/emails/{id} 获取
+LIST_COLUMNS = (
+    "id, message_id, account_id, sender, subject, snippet, received_at, language, "
+    "status, category_id, confidence, created_at"
+)
+
+
+def _encode_cursor(row) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["received_at"], row["id"]]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        received_at, email_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(received_at), int(email_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("")
 def list_emails(
     status: Optional[str] = None,
     page: int = 1,
-    page_size: int = 10
+    page_size: int = 10,
+    cursor: Optional[str] = None,
 ):
     """
     获取邮件列表，支持分页
     - page: 页码，从1开始
     - page_size: 每页数量，默认20
+    - cursor: 键集分页，按 (received_at, id) 定位；传空字符串取第一页，之后传上一页返回的 next_cursor。
+      传入 cursor 时忽略 page，翻到多深都只读取 page_size 行
     """
-    offset = (page - 1) * page_size
-
-    # 获取总数和待处理数
-    total_all = db.fetch_one("SELECT COUNT(*) as count FROM emails")
-    pending_count = db.fetch_one("SELECT COUNT(*) as count FROM emails WHERE status = 'pending'")
-
-    if status:
+    # 计数来自触发器维护的 email_counters，不再每次 COUNT(*)
+    counts = db.email_counts()
+    total_count = sum(counts.values())
+    total = counts.get(status, 0) if status else total_count
+
+    where, params = ("WHERE status = ?", [status]) if status else ("", [])
+    if cursor is not None:
+        if cursor:
+            received_at, email_id = _decode_cursor(cursor)
+            where = f"{where} AND" if where else "WHERE"
+            where += " (received_at, id) < (?, ?)"
+            params += [received_at, email_id]
         rows = db.fetch_all(
-            "SELECT * FROM emails WHERE status = ? ORDER BY received_at DESC LIMIT ? OFFSET ?",
-            (status, page_size, offset)
+            f"SELECT {LIST_COLUMNS} FROM emails {where} ORDER BY received_at DESC, id DESC LIMIT ?",
+            (*params, page_size + 1),
         )
-        total = db.fetch_one(
-            "SELECT COUNT(*) as count FROM emails WHERE status = ?",
-            (status,)
-        )
-    else:
-        rows = db.fetch_all(
-            "SELECT * FROM emails ORDER BY received_at DESC LIMIT ? OFFSET ?",
-            (page_size, offset)
-        )
-        total = db.fetch_one("SELECT COUNT(*) as count FROM emails")
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        return {
+            "data": [dict(row) for row in rows],
+            "total": total,
+            "page_size": page_size,
+            "next_cursor": _encode_cursor(rows[-1]) if has_more else None,
+            "pending_count": counts.get("pending", 0),
+            "total_count": total_count,
+        }
+
+    offset = (page - 1) * page_size
+    rows = db.fetch_all(
+        f"SELECT {LIST_COLUMNS} FROM emails {where} ORDER BY received_at DESC, id DESC LIMIT ? OFFSET ?",
+        (*params, page_size, offset),
+    )
 
     return {
         "data": [dict(row) for row in rows],
-        "total": total["count"] if total else 0,
+        "total": total,
         "page": page,
         "page_size": page_size,
-        "total_pages": (total["count"] // page_size) + (1 if total["count"] % page_size > 0 else 0) if total else 0,
-        "pending_count": pending_count["count"] if pending_count else 0,
-        "total_count": total_all["count"] if total_all else 0,
+        "total_pages": (total // page_size) + (1 if total % page_size > 0 else 0),
+        "pending_count": counts.get("pending", 0),
+        "total_count": total_count,
     }
 
 
+@router.get("/search")
+def search_emails(q: str, status: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """
+    全文检索主题、发件人、正文、译文和最终回复，按相关度排序
+    - q: 检索词，多个词以空格分隔，需全部命中
+    - status: 按状态过滤，与列表接口一致
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    return {"data": db.search_emails(q, status, limit, offset)}
+
+
 @router.get("/{email_id}")
 def get_email(email_id: int):
-    row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
+    """邮件详情，包含列表接口不返回的正文、译文和回复"""
+    row = db.load_email(email_id)
     if not row:
         raise HTTPException(status_code=404, detail="Email not found")
-    return dict(row)
+    return row
 
 
 @router.post("/sync")
-def sync_emails():
-    from ..scheduler.poller import EmailPoller
-
-    poller = EmailPoller()
+async def sync_emails():
+    # 交给运行中的轮询器，与该账号的后台拉取串行执行
     try:
-        poller.pull_once()
+        await email_poller.pull_once()
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -103,23 +158,25 @@ def analyze(email_id: int, payload: AnalyzeRequest):
     1. 分类（关键词 > AI语义 > 默认）
     2. 生成回复（模板匹配 > AI生成）
     """
-    email_row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
+    email_row = db.load_email(email_id)
     if not email_row:
         raise HTTPException(status_code=404, detail="Email not found")
 
-    categories = [dict(row) for row in db.fetch_all("SELECT * FROM categories ORDER BY priority DESC")]
+    config = config_cache.get()
+    categories = config.categories
     if not categories:
         raise HTTPException(status_code=400, detail="No categories")
 
-    templates = [dict(row) for row in db.fetch_all("SELECT * FROM templates")]
-    ai_key = db.get_setting("deepseek_api_key", "")
-    base_url = db.get_setting("deepseek_base_url", "https://api.deepseek.com")
-    model = db.get_setting("deepseek_model", "deepseek-chat")
+    templates = config.templates
+    ai_key = config.setting("deepseek_api_key", "")
+    base_url = config.setting("deepseek_base_url", "https://api.deepseek.com")
+    model = config.setting("deepseek_model", "deepseek-chat")
+    local_threshold = config.number("local_classifier_threshold", LOCAL_CLASSIFIER_THRESHOLD)
     email_text = email_row["body_text"] or email_row["subject"]
 
     # ── 阶段一：分类 ──
     category, confidence, method, reason = classify_email(
-        email_text, categories, ai_key, base_url, model,
+        email_text, categories, ai_key, base_url, model, local_threshold,
     )
 
     # ── 阶段二：生成回复 ──
@@ -127,10 +184,7 @@ def analyze(email_id: int, payload: AnalyzeRequest):
     reply_source = None
 
     # 优先匹配模板
-    template_row = db.fetch_one(
-        "SELECT * FROM templates WHERE category_id = ? ORDER BY id DESC LIMIT 1",
-        (category["id"],),
-    )
+    template_row = config.latest_template(category["id"])
     if template_row:
         # 从邮件内容提取变量并渲染模板
         template_dict = dict(template_row)
@@ -193,22 +247,21 @@ def analyze(email_id: int, payload: AnalyzeRequest):
 @router.post("/{email_id}/generate-reply")
 def generate_reply(email_id: int):
     """手动触发 AI 生成回复（当用户不满意模板时使用）"""
-    email_row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
+    email_row = db.load_email(email_id)
     if not email_row:
         raise HTTPException(status_code=404, detail="Email not found")
 
-    ai_key = db.get_setting("deepseek_api_key", "")
+    config = config_cache.get()
+    ai_key = config.setting("deepseek_api_key", "")
     if not ai_key:
         raise HTTPException(status_code=400, detail="AI key not configured")
 
-    base_url = db.get_setting("deepseek_base_url", "https://api.deepseek.com")
-    model = db.get_setting("deepseek_model", "deepseek-chat")
+    base_url = config.setting("deepseek_base_url", "https://api.deepseek.com")
+    model = config.setting("deepseek_model", "deepseek-chat")
     email_text = email_row["body_text"] or email_row["subject"]
 
     # 获取分类信息
-    categories = [dict(row) for row in db.fetch_all("SELECT * FROM categories ORDER BY priority DESC")]
-    category_id = email_row["category_id"]
-    category = next((c for c in categories if c["id"] == category_id), categories[0])
+    category = config.category(email_row["category_id"]) or config.categories[0]
 
     reply_result = generate_reply_ai(
         api_key=ai_key,
@@ -229,51 +282,124 @@ def generate_reply(email_id: int):
 
 
 @router.post("/{email_id}/send")
-def send_email(email_id: int, payload: EmailSendRequest):
-    email_row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
+async def send_email(email_id: int, payload: EmailSendRequest):
+    def load():
+        email_row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
+        # 从收到该邮件的账号回复
+        return email_row, db.get_mail_account(email_row["account_id"]) if email_row else None
+
+    # 异步路由里的查库放到线程中，不阻塞事件循环
+    email_row, account = await asyncio.to_thread(load)
     if not email_row:
         raise HTTPException(status_code=404, detail="Email not found")
-
-    account = db.fetch_one("SELECT * FROM mail_accounts ORDER BY updated_at DESC LIMIT 1")
     if not account:
         raise HTTPException(status_code=400, detail="Mail account not configured")
 
-    response = send_reply(
-        host=account["smtp_host"],
-        port=account["smtp_port"],
-        username=account["username"],
-        password=account["password"],
-        to_addr=email_row["sender"],
-        subject=f"Re: {email_row['subject']}",
-        body=payload.reply,
-        use_ssl=bool(account["use_ssl"]),
-    )
+    # 写入发件箱即返回，由后台任务发送、重试并记录 SMTP 结果
+    category_id = payload.category_id or email_row["category_id"]
 
-    db.execute(
-        "UPDATE emails SET status = 'sent', final_reply = ?, category_id = ? WHERE id = ?",
-        (payload.reply, payload.category_id or email_row["category_id"], email_id),
-    )
-
-    db.execute(
-        "INSERT INTO email_actions (email_id, ai_category_id, ai_confidence, final_category_id, sent_at, smtp_response) VALUES (?, ?, ?, ?, ?, ?)",
-        (
+    def enqueue(conn) -> int:
+        outbox_id = db.enqueue_outbox(
             email_id,
-            email_row["category_id"],
-            email_row["confidence"],
-            payload.category_id or email_row["category_id"],
-            datetime.utcnow().isoformat(),
-            response,
-        ),
+            account["id"],
+            email_row["sender"],
+            f"Re: {email_row['subject']}",
+            payload.reply,
+            category_id,
+            conn=conn,
+        )
+        conn.execute(
+            "UPDATE emails SET status = 'queued', final_reply = ?, category_id = ? WHERE id = ?",
+            (payload.reply, category_id, email_id),
+        )
+        return outbox_id
+
+    outbox_id = await asyncio.wrap_future(db.submit_write(enqueue))
+    outbox_worker.wake()
+
+    return {"status": "queued", "outbox_id": outbox_id}
+
+
+@router.post("/send-batch")
+async def send_batch(payload: List[BatchSendItem]):
+    """批量发送：一次查询取出所有邮件，一个写操作写入发件箱，由后台任务按账号复用 SMTP 会话投递"""
+    email_ids = [item.email_id for item in payload]
+
+    def load():
+        placeholders = ",".join("?" * len(email_ids))
+        rows = {
+            row["id"]: row
+            for row in (db.fetch_all(f"SELECT * FROM emails WHERE id IN ({placeholders})", email_ids) if email_ids else [])
+        }
+        accounts = {account_id: db.get_mail_account(account_id) for account_id in {row["account_id"] for row in rows.values()}}
+        return rows, accounts
+
+    # 异步路由里的查库放到线程中，不阻塞事件循环
+    rows, accounts = await asyncio.to_thread(load)
+
+    results = []
+    queued = []
+    for item in payload:
+        email_row = rows.get(item.email_id)
+        if not email_row:
+            results.append({"email_id": item.email_id, "status": "error", "error": "Email not found"})
+            continue
+        reply = item.reply or email_row["ai_reply"]
+        if not reply:
+            results.append({"email_id": item.email_id, "status": "error", "error": "No reply to send"})
+            continue
+        account = accounts[email_row["account_id"]]
+        if not account:
+            results.append({"email_id": item.email_id, "status": "error", "error": "Mail account not configured"})
+            continue
+        result = {"email_id": item.email_id, "status": "queued"}
+        results.append(result)
+        queued.append((result, email_row, account, reply, item.category_id or email_row["category_id"]))
+
+    def enqueue(conn) -> None:
+        for result, email_row, account, reply, category_id in queued:
+            result["outbox_id"] = db.enqueue_outbox(
+                email_row["id"],
+                account["id"],
+                email_row["sender"],
+                f"Re: {email_row['subject']}",
+                reply,
+                category_id,
+                conn=conn,
+            )
+            conn.execute(
+                "UPDATE emails SET status = 'queued', final_reply = ?, category_id = ? WHERE id = ?",
+                (reply, category_id, email_row["id"]),
+            )
+
+    if queued:
+        await asyncio.wrap_future(db.submit_write(enqueue))
+    outbox_worker.wake()
+
+    return {"results": results}
+
+
+@router.get("/{email_id}/delivery")
+def get_delivery_status(email_id: int):
+    """最近一次回复的投递状态：pending | sending | sent | failed"""
+    row = db.fetch_one(
+        """
+        SELECT id, status, attempts, next_attempt_at, last_error, smtp_response, created_at, updated_at
+        FROM outbox WHERE email_id = ? ORDER BY id DESC LIMIT 1
+        """,
+        (email_id,),
     )
-
-    return {"status": "sent"}
+    if not row:
+        raise HTTPException(status_code=404, detail="No reply queued for this email")
+    return dict(row)
 
 
 @router.post("/translate")
 def translate_text(payload: TranslateRequest):
     """翻译文本（用于回复内容翻译预览），支持双向翻译"""
-    baidu_appid = db.get_setting("baidu_appid", "")
-    baidu_secret = db.get_setting("baidu_secret", "")
+    config = config_cache.get()
+    baidu_appid = config.setting("baidu_appid", "")
+    baidu_secret = config.setting("baidu_secret", "")
 
     if not baidu_appid or not baidu_secret:
         raise HTTPException(status_code=400, detail="Baidu translation not configured")
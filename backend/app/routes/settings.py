@@ -1,14 +1,19 @@
+import json
 from datetime import datetime
+from typing import Dict, Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
 from ..db import db
+from ..services.config_cache import config_cache
+from ..services.smtp_pool import smtp_pool
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
 
 
 class MailAccountRequest(BaseModel):
+    id: Optional[int] = None  # 修改已有账号时传入；为空时按邮箱地址新增或更新
     email: str
     imap_host: str
     imap_port: int
@@ -17,10 +22,16 @@ class MailAccountRequest(BaseModel):
     username: str
     password: str
     use_ssl: bool = True
+    fetch_interval: Optional[int] = None  # 为空时使用全局 fetch_interval
 
 
 class SettingsRequest(BaseModel):
     fetch_interval: int = 300
+    fetch_mode: str = "interval"  # interval | idle
+    text_part_limit: int = 0  # 每个正文分段最多下载的字节数，0 表示不截断
+    smtp_rate_limits: Dict[str, int] = {}  # {smtp_host: 每分钟最多发送封数}
+    retention_days: int = 90  # 已发送、已删除邮件超过该天数后移到 archive.db，0 表示不归档
+    local_classifier_threshold: float = 0.85  # 本地分类模型的置信度阈值，低于阈值交给 AI，0 表示不使用
     target_lang: str = "zh"
     baidu_appid: str
     baidu_secret: str
@@ -31,44 +42,104 @@ class SettingsRequest(BaseModel):
 
 @router.get("")
 def get_settings():
-    settings = db.get_settings()
+    settings = dict(config_cache.get().settings)
+    # 库中以 JSON 字符串保存，返回对象，前端原样提交时才能通过 SettingsRequest 校验
+    try:
+        settings["smtp_rate_limits"] = json.loads(settings.get("smtp_rate_limits") or "{}")
+    except ValueError:
+        settings["smtp_rate_limits"] = {}
     account = db.fetch_one("SELECT * FROM mail_accounts ORDER BY updated_at DESC LIMIT 1")
     return {
         "settings": settings,
         "mail_account": dict(account) if account else None,
+        "mail_accounts": [dict(row) for row in db.list_mail_accounts()],
     }
 
 
 @router.post("")
 def update_settings(payload: SettingsRequest):
     db.set_setting("fetch_interval", str(payload.fetch_interval))
+    db.set_setting("fetch_mode", payload.fetch_mode)
+    db.set_setting("text_part_limit", str(payload.text_part_limit))
+    db.set_setting("smtp_rate_limits", json.dumps(payload.smtp_rate_limits))
+    smtp_pool.rate_limiter.configure(payload.smtp_rate_limits)
+    db.set_setting("retention_days", str(payload.retention_days))
+    db.set_setting("local_classifier_threshold", str(payload.local_classifier_threshold))
     db.set_setting("target_lang", payload.target_lang)
     db.set_setting("baidu_appid", payload.baidu_appid)
     db.set_setting("baidu_secret", payload.baidu_secret)
     db.set_setting("deepseek_api_key", payload.deepseek_api_key)
     db.set_setting("deepseek_base_url", payload.deepseek_base_url)
     db.set_setting("deepseek_model", payload.deepseek_model)
+    config_cache.bump()
     return {"status": "ok"}
 
 
 @router.post("/mail-account")
 def update_mail_account(payload: MailAccountRequest):
-    db.execute(
+    """
+    带 id 时修改该账号（包括改邮箱地址），否则按邮箱地址新增或更新；多个邮箱会同时被轮询。
+    邮箱地址、IMAP 服务器或用户名变化后原来的 UID 水位不再适用，清除后从头同步。
+    """
+    same_email = db.fetch_one("SELECT id FROM mail_accounts WHERE email = ? ORDER BY id DESC LIMIT 1", (payload.email,))
+    if payload.id is not None:
+        existing = db.fetch_one("SELECT * FROM mail_accounts WHERE id = ?", (payload.id,))
+        if not existing:
+            raise HTTPException(status_code=404, detail="Mail account not found")
+        if same_email and same_email["id"] != payload.id:
+            raise HTTPException(status_code=400, detail="Mail account already exists")
+        if (existing["email"], existing["imap_host"], existing["username"]) != (payload.email, payload.imap_host, payload.username):
+            db.execute("DELETE FROM mail_sync_state WHERE account_id = ?", (payload.id,))
+    else:
+        existing = same_email
+    values = (
+        payload.email,
+        payload.imap_host,
+        payload.imap_port,
+        payload.smtp_host,
+        payload.smtp_port,
+        payload.username,
+        payload.password,
+        int(payload.use_ssl),
+        payload.fetch_interval,
+        datetime.utcnow().isoformat(),
+    )
+    if existing:
+        db.execute(
+            """
+            UPDATE mail_accounts SET
+            email = ?, imap_host = ?, imap_port = ?, smtp_host = ?, smtp_port = ?,
+            username = ?, password = ?, use_ssl = ?, fetch_interval = ?, updated_at = ?
+            WHERE id = ?
+            """,
+            values + (existing["id"],),
+        )
+        return {"status": "ok", "id": existing["id"]}
+
+    account_id = db.execute(
         """
         INSERT INTO mail_accounts
-        (email, imap_host, imap_port, smtp_host, smtp_port, username, password, use_ssl, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        (email, imap_host, imap_port, smtp_host, smtp_port, username, password, use_ssl, fetch_interval, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """,
-        (
-            payload.email,
-            payload.imap_host,
-            payload.imap_port,
-            payload.smtp_host,
-            payload.smtp_port,
-            payload.username,
-            payload.password,
-            int(payload.use_ssl),
-            datetime.utcnow().isoformat(),
-        ),
+        values,
     )
-    return {"status": "ok"}
+    return {"status": "ok", "id": account_id}
+
+
+@router.get("/mail-accounts")
+def list_mail_accounts():
+    return [dict(row) for row in db.list_mail_accounts()]
+
+
+@router.delete("/mail-accounts/{account_id}")
+def delete_mail_account(account_id: int):
+    existing = db.fetch_one("SELECT * FROM mail_accounts WHERE id = ?", (account_id,))
+    if not existing:
+        raise HTTPException(status_code=404, detail="Mail account not found")
+    db.execute(
+        "DELETE FROM mail_sync_state WHERE account_id IN (SELECT id FROM mail_accounts WHERE email = ?)",
+        (existing["email"],),
+    )
+    db.execute("DELETE FROM mail_accounts WHERE email = ?", (existing["email"],))
+    return {"status": "deleted"}
@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 
 from ..db import db
+from ..services.config_cache import config_cache
 
 router = APIRouter(prefix="/api/templates", tags=["templates"])
 
@@ -25,6 +26,7 @@ def create_template(payload: TemplateRequest):
         "INSERT INTO templates (category_id, name, content, variables) VALUES (?, ?, ?, ?)",
         (payload.category_id, payload.name, payload.content, payload.variables),
     )
+    config_cache.bump()
     return {"id": template_id}
 
 
@@ -34,6 +36,7 @@ def update_template(template_id: int, payload: TemplateRequest):
         "UPDATE templates SET category_id = ?, name = ?, content = ?, variables = ? WHERE id = ?",
         (payload.category_id, payload.name, payload.content, payload.variables, template_id),
     )
+    config_cache.bump()
     return {"status": "ok"}
 
 
@@ -43,4 +46,5 @@ def delete_template(template_id: int):
     if not existing:
         raise HTTPException(status_code=404, detail="Template not found")
     db.execute("DELETE FROM templates WHERE id = ?", (template_id,))
+    config_cache.bump()
     return {"status": "deleted"}
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from ..db import db
+from ..services.local_classifier import local_classifier
+from ..services.smtp_pool import smtp_pool
+
+logger = logging.getLogger(__name__)
+
+# 没有新任务时检查到期重试的间隔
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 6
+# 第 n 次失败后等待 OUTBOX_RETRY_BASE_SECONDS * 2^(n-1) 秒再重试，最长 OUTBOX_RETRY_MAX_SECONDS
+OUTBOX_RETRY_BASE_SECONDS = 30
+OUTBOX_RETRY_MAX_SECONDS = 60 * 60
+
+
+def _is_permanent(e: Exception) -> bool:
+    """收件人被拒、5xx 等重试也不会成功的错误；认证失败可能是配置问题，仍然重试"""
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        return False
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(e, smtplib.SMTPResponseException) and 500 <= e.smtp_code < 600
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_SECONDS)
+
+
+class OutboxWorker:
+    """
+    后台投递任务。
+    发送接口只把回复写入 outbox 表，这里按账号分组，用 SMTP 连接池批量发送；
+    临时错误按指数退避重试，结果写入 email_actions，状态可通过 GET /api/emails/{id}/delivery 查询。
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        self._wakeup = asyncio.Event()
+        # 写库失败的投递结果 [(rows, results)]，每轮重试写入；已发出的邮件不能重新排队，否则会重复发送
+        self._deferred: List[Tuple[List, List]] = []
+        self._deferred_lock = threading.Lock()
+
+    async def start(self) -> None:
+        if self._task:
+            return
+        self._running = True
+        requeued = await asyncio.to_thread(db.reset_stale_outbox)
+        if requeued:
+            logger.info(f"Requeued {requeued} outbox message(s) interrupted by shutdown")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await asyncio.to_thread(self._retry_deferred)
+
+    def wake(self) -> None:
+        """有新邮件入队时立即投递，不等下一次检查"""
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        while self._running:
+            # 任何异常都只记录日志，任务不能退出，否则认领的邮件会一直停在 sending
+            try:
+                await asyncio.to_thread(self._retry_deferred)
+                rows = await asyncio.to_thread(db.claim_outbox, OUTBOX_BATCH_SIZE)
+                if rows:
+                    await self._deliver(rows)
+                    continue
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _deliver(self, rows: List) -> None:
+        by_account: Dict[Optional[int], List] = {}
+        for row in rows:
+            by_account.setdefault(row["account_id"], []).append(row)
+        # 不同账号并发发送，同一账号在一个 SMTP 会话里依次发送
+        await asyncio.gather(
+            *(asyncio.to_thread(self._deliver_account, account_id, items) for account_id, items in by_account.items())
+        )
+
+    def _deliver_account(self, account_id: Optional[int], rows: List) -> None:
+        try:
+            results = self._send(account_id, rows)
+        except Exception as e:
+            # 发送前失败（如读取账号时数据库繁忙），邮件没有发出，按临时错误退避重试
+            results = [e] * len(rows)
+        self._record_or_defer(rows, results)
+        # 新发送的回复带有客服确认的分类，增量训练本地分类模型
+        if any(not isinstance(result, Exception) for result in results):
+            try:
+                local_classifier.refresh()
+            except Exception as e:
+                logger.error(f"Failed to train local classifier: {e}")
+
+    @staticmethod
+    def _send(account_id: Optional[int], rows: List) -> List:
+        account = db.get_mail_account(account_id)
+        if not account:
+            return [ValueError("Mail account not configured")] * len(rows)
+        try:
+            return smtp_pool.send_batch(
+                host=account["smtp_host"],
+                port=account["smtp_port"],
+                username=account["username"],
+                password=account["password"],
+                use_ssl=bool(account["use_ssl"]),
+                messages=[(row["to_addr"], row["subject"], row["body"]) for row in rows],
+            )
+        except Exception as e:
+            return [e] * len(rows)
+
+    def _record_or_defer(self, rows: List, results: List) -> None:
+        """写入投递结果；失败时留到下一轮重试，失败的邮件届时回到 pending 并退避"""
+        try:
+            self._record(rows, results)
+        except Exception as e:
+            logger.error(f"Failed to record delivery of {len(rows)} outbox message(s), will retry: {e}")
+            with self._deferred_lock:
+                self._deferred.append((rows, results))
+
+    def _retry_deferred(self) -> None:
+        with self._deferred_lock:
+            deferred, self._deferred = self._deferred, []
+        for rows, results in deferred:
+            self._record_or_defer(rows, results)
+
+    @staticmethod
+    def _record(rows: List, results: List) -> None:
+        """整批投递结果在一个写操作里写入 outbox、emails 和 email_actions"""
+        email_ids = [row["email_id"] for row in rows if row["email_id"] is not None]
+        placeholders = ",".join("?" * len(email_ids))
+        emails = {
+            email_row["id"]: email_row
+            for email_row in (db.fetch_all(f"SELECT * FROM emails WHERE id IN ({placeholders})", email_ids) if email_ids else [])
+        }
+
+        def record(conn) -> None:
+            for row, result in zip(rows, results):
+                if isinstance(result, Exception):
+                    OutboxWorker._record_failure(conn, row, result)
+                else:
+                    OutboxWorker._record_success(conn, row, emails.get(row["email_id"]), result)
+
+        db.write(record)
+
+    @staticmethod
+    def _record_success(conn, row, email_row, response: Optional[str]) -> None:
+        now = datetime.utcnow().isoformat()
+        conn.execute(
+            "UPDATE outbox SET status = 'sent', attempts = attempts + 1, smtp_response = ?, last_error = NULL, updated_at = ? WHERE id = ?",
+            (response, now, row["id"]),
+        )
+        if not email_row:
+            return
+        final_category_id = row["category_id"] or email_row["category_id"]
+        conn.execute(
+            "UPDATE emails SET status = 'sent', final_reply = ?, category_id = ? WHERE id = ?",
+            (row["body"], final_category_id, row["email_id"]),
+        )
+        conn.execute(
+            "INSERT INTO email_actions (email_id, ai_category_id, ai_confidence, final_category_id, sent_at, smtp_response) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                row["email_id"],
+                email_row["category_id"],
+                email_row["confidence"],
+                final_category_id,
+                now,
+                response,
+            ),
+        )
+        logger.info(f"Delivered reply for email {row['email_id']}")
+
+    @staticmethod
+    def _record_failure(conn, row, error: Exception) -> None:
+        now = datetime.utcnow()
+        attempts = row["attempts"] + 1
+        if _is_permanent(error) or attempts >= OUTBOX_MAX_ATTEMPTS:
+            logger.error(f"Delivery of outbox {row['id']} failed after {attempts} attempt(s): {error}")
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                (attempts, str(error), now.isoformat(), row["id"]),
+            )
+            if row["email_id"] is not None:
+                # 回到待处理列表，由客服决定是否重新发送
+                conn.execute("UPDATE emails SET status = 'pending' WHERE id = ? AND status = 'queued'", (row["email_id"],))
+                conn.execute(
+                    "INSERT INTO email_actions (email_id, final_category_id, smtp_response) VALUES (?, ?, ?)",
+                    (row["email_id"], row["category_id"], f"failed: {error}"),
+                )
+            return
+        delay = _retry_delay(attempts)
+        logger.warning(f"Delivery of outbox {row['id']} failed ({error}), retrying in {delay:.0f}s")
+        conn.execute(
+            "UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+            (attempts, str(error), (now + timedelta(seconds=delay)).isoformat(), now.isoformat(), row["id"]),
+        )
+
+outbox_worker = OutboxWorker()
@@ -1,84 +1,253 @@
 import asyncio
+import json
 import logging
 import re
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from ..db import db
-from ..services.email_client import fetch_unreplied
+from ..services.async_mail import AsyncIMAPClient, iter_mailbox_async, open_mailbox_async
+from ..services.email_client import IMAP_IDLE_RETRY_SECONDS
 from ..services.translator import translate_baidu
 from ..services.classifier import classify_email
+from ..services.config_cache import config_cache
+from ..services.local_classifier import DEFAULT_THRESHOLD as LOCAL_CLASSIFIER_THRESHOLD
 from ..services.template_engine import build_variables, render_template
 from ..utils import detect_language
 
 logger = logging.getLogger(__name__)
 
 
+# 所有账号共享的并发拉取上限，慢的服务商只占用一个名额
+POLL_WORKERS = 4
+# 重新读取账号列表的间隔，用于感知新增、修改和删除的账号
+ACCOUNT_REFRESH_SECONDS = 60
+# 连接闲置超过该时长后不再复用，重新登录（多数服务器 30 分钟自动登出）
+IMAP_SESSION_MAX_IDLE = 10 * 60
+
+
+def _text_part_limit() -> Optional[int]:
+    """每个正文分段最多下载的字节数，未配置或为 0 时不截断"""
+    try:
+        return int(config_cache.get().setting("text_part_limit", "0") or 0) or None
+    except ValueError:
+        return None
+
+
 class EmailPoller:
     def __init__(self) -> None:
         self._task: Optional[asyncio.Task] = None
         self._running = False
+        # account_id -> (updated_at, task)
+        self._account_tasks: Dict[int, Tuple[str, asyncio.Task]] = {}
+        self._slots = asyncio.Semaphore(POLL_WORKERS)
+        # 每个账号一把锁，调度任务和临时连接不会同时读写同一账号的 UID 水位
+        self._account_locks: Dict[int, asyncio.Lock] = {}
+        # 手动同步：设置 account_id 对应的事件唤醒调度任务，拉取完成后设置等待中的 future
+        self._wake_events: Dict[int, asyncio.Event] = {}
+        self._sync_waiters: Dict[int, List[asyncio.Future]] = {}
 
-    async def start(self, interval_seconds: int) -> None:
+    async def start(self, interval_seconds: int, mode: str = "interval") -> None:
         if self._task:
             return
         self._running = True
-        self._task = asyncio.create_task(self._run(interval_seconds))
+        self._task = asyncio.create_task(self._run(interval_seconds, mode))
 
     async def stop(self) -> None:
         self._running = False
+        for _, task in self._account_tasks.values():
+            task.cancel()
+        self._account_tasks.clear()
         if self._task:
             self._task.cancel()
             self._task = None
 
-    async def _run(self, interval_seconds: int) -> None:
+    async def _run(self, interval_seconds: int, mode: str = "interval") -> None:
+        """每个账号一个调度任务，各自的间隔、连接和同步状态互不影响"""
         while self._running:
             try:
-                await asyncio.to_thread(self.pull_once)
-            except Exception:
-                pass
-            await asyncio.sleep(interval_seconds)
-
-    def pull_once(self) -> None:
-        account = db.fetch_one("SELECT * FROM mail_accounts ORDER BY updated_at DESC LIMIT 1")
-        if not account:
+                accounts = {row["id"]: dict(row) for row in await asyncio.to_thread(db.list_mail_accounts)}
+            except Exception as e:
+                logger.error(f"Failed to load mail accounts: {e}")
+                accounts = None
+
+            if accounts is not None:
+                for account_id, (updated_at, task) in list(self._account_tasks.items()):
+                    account = accounts.get(account_id)
+                    if task.done() or not account or account["updated_at"] != updated_at:
+                        task.cancel()
+                        del self._account_tasks[account_id]
+                for account_id, account in accounts.items():
+                    if account_id not in self._account_tasks:
+                        interval = account.get("fetch_interval") or interval_seconds
+                        task = asyncio.create_task(self._watch_account(account, interval, mode))
+                        self._account_tasks[account_id] = (account["updated_at"], task)
+                if not accounts:
+                    logger.warning("No mail account configured")
+
+            await asyncio.sleep(ACCOUNT_REFRESH_SECONDS)
+
+    async def _watch_account(self, account: Dict, interval_seconds: int, mode: str) -> None:
+        """
+        单个账号的调度循环，持有该账号唯一的 asyncio 连接。
+        interval 模式定时增量拉取，复用前用 NOOP 校验；idle 模式收到 EXISTS 后立即拉取，
+        服务器不支持 IDLE 时回退到定时轮询。手动同步通过唤醒事件在同一个连接上立即拉取一次。
+        """
+        account_id = account["id"]
+        wake = self._wake_events.setdefault(account_id, asyncio.Event())
+        use_idle = mode == "idle"
+        idle_checked = False
+        mail: Optional[AsyncIMAPClient] = None
+        last_used = 0.0
+        try:
+            while self._running:
+                # 本轮开始前登记的手动同步，在本轮拉取完成后返回；拉取期间新登记的等下一轮
+                wake.clear()
+                waiters = self._sync_waiters.pop(account_id, [])
+                try:
+                    if mail and not use_idle:
+                        if time.monotonic() - last_used > IMAP_SESSION_MAX_IDLE:
+                            await mail.close()
+                            mail = None
+                        else:
+                            try:
+                                await mail.noop()
+                            except Exception as e:
+                                logger.info(f"Dropping stale IMAP session for {account['username']}: {e}")
+                                await mail.close()
+                                mail = None
+                    if not mail:
+                        mail = await open_mailbox_async(
+                            host=account["imap_host"],
+                            port=account["imap_port"],
+                            username=account["username"],
+                            password=account["password"],
+                            use_ssl=bool(account["use_ssl"]),
+                        )
+                    if use_idle and not idle_checked:
+                        idle_checked = True
+                        if "IDLE" not in await mail.capabilities():
+                            logger.warning(f"{account['imap_host']} does not support IDLE")
+                            logger.info(f"Falling back to interval polling for {account['username']}")
+                            use_idle = False
+
+                    await self.pull_account_async(account, mail)
+                    last_used = time.monotonic()
+                    _resolve(waiters)
+                    if use_idle:
+                        # 超时无新邮件时重新发起 IDLE，避免被服务器断开
+                        while self._running and not wake.is_set() and not await mail.idle(wake=wake):
+                            pass
+                        continue
+                except Exception as e:
+                    logger.error(f"Polling {account['username']} failed: {e}")
+                    _resolve(waiters, e)
+                    if mail:
+                        await mail.close()
+                        mail = None
+                    if use_idle:
+                        await _wait(wake, IMAP_IDLE_RETRY_SECONDS)
+                        continue
+                await _wait(wake, interval_seconds)
+        finally:
+            _resolve(self._sync_waiters.pop(account_id, []), ValueError("Mail account watcher stopped"))
+            if mail:
+                await mail.close()
+
+    def _account_lock(self, account_id: int) -> asyncio.Lock:
+        return self._account_locks.setdefault(account_id, asyncio.Lock())
+
+    async def pull_account_async(self, account: Dict, mail: AsyncIMAPClient) -> None:
+        """在已选中收件箱的 asyncio 连接上拉取新邮件，逐批入库（入库处理放到线程中执行）"""
+        async with self._account_lock(account["id"]), self._slots:
+            logger.info(f"Fetching emails from {account['username']}")
+            sync_state = await asyncio.to_thread(db.get_sync_state, account["id"], "INBOX")
+            chunks = iter_mailbox_async(
+                mail,
+                sync_state["uidvalidity"] if sync_state else None,
+                sync_state["last_uid"] if sync_state else 0,
+                db.existing_message_ids,
+                part_limit=await asyncio.to_thread(_text_part_limit),
+            )
+            while True:
+                try:
+                    emails, uidvalidity, last_uid = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    raise ValueError(f"Failed to fetch emails: {e}") from e
+                await asyncio.to_thread(self._ingest, account, emails, uidvalidity, last_uid)
+
+    async def pull_once(self) -> None:
+        """
+        拉取所有账号的新邮件（手动同步），等所有账号拉取完成后返回。
+        账号已有调度任务时唤醒它在已登录的连接上拉取，不再另开一个 IMAP 会话；
+        轮询器未启动或新账号还没有调度任务时，临时建立连接拉取一次。
+        """
+        accounts = [dict(row) for row in await asyncio.to_thread(db.list_mail_accounts)]
+        if not accounts:
             logger.warning("No mail account configured")
             raise ValueError("No mail account configured")
 
-        logger.info(f"Fetching emails from {account['username']}")
+        results = await asyncio.gather(*(self._request_pull(account) for account in accounts), return_exceptions=True)
+        errors = [f"{account['username']}: {result}" for account, result in zip(accounts, results) if isinstance(result, Exception)]
+        if errors and len(errors) == len(accounts):
+            raise ValueError("; ".join(errors))
+        for error in errors:
+            logger.warning(f"Sync failed for {error}")
 
+    async def _request_pull(self, account: Dict) -> None:
+        entry = self._account_tasks.get(account["id"])
+        if self._running and entry and entry[0] == account["updated_at"] and not entry[1].done():
+            future = asyncio.get_running_loop().create_future()
+            self._sync_waiters.setdefault(account["id"], []).append(future)
+            self._wake_events[account["id"]].set()
+            await future
+            return
+        mail = await open_mailbox_async(
+            host=account["imap_host"],
+            port=account["imap_port"],
+            username=account["username"],
+            password=account["password"],
+            use_ssl=bool(account["use_ssl"]),
+        )
         try:
-            emails = fetch_unreplied(
-                host=account["imap_host"],
-                port=account["imap_port"],
-                username=account["username"],
-                password=account["password"],
-                use_ssl=bool(account["use_ssl"]),
-            )
-        except Exception as e:
-            logger.error(f"Failed to fetch emails: {e}", exc_info=True)
-            raise ValueError(f"Failed to fetch emails: {e}") from e
+            await self.pull_account_async(account, mail)
+        finally:
+            await mail.close()
 
+    def _ingest(self, account: Dict, emails: list[dict], uidvalidity: Optional[int], last_uid: int) -> None:
+        """翻译、分类、生成回复并入库，最后推进该账号的 UID 水位"""
         if not emails:
+            db.set_sync_state(account["id"], "INBOX", uidvalidity, last_uid)
             logger.info("No new emails to process")
             return
 
         logger.info(f"Processing {len(emails)} new email(s)")
 
-        baidu_appid = db.get_setting("baidu_appid", "")
-        baidu_secret = db.get_setting("baidu_secret", "")
-        target_lang = db.get_setting("target_lang", "zh")
+        config = config_cache.get()
+        baidu_appid = config.setting("baidu_appid", "")
+        baidu_secret = config.setting("baidu_secret", "")
+        target_lang = config.setting("target_lang", "zh")
 
         # 获取分类配置
-        categories = [dict(row) for row in db.fetch_all("SELECT * FROM categories ORDER BY priority DESC")]
-        ai_key = db.get_setting("deepseek_api_key", "")
-        base_url = db.get_setting("deepseek_base_url", "https://api.deepseek.com")
-        model = db.get_setting("deepseek_model", "deepseek-chat")
+        categories = config.categories
+        ai_key = config.setting("deepseek_api_key", "")
+        base_url = config.setting("deepseek_base_url", "https://api.deepseek.com")
+        model = config.setting("deepseek_model", "deepseek-chat")
+        local_threshold = config.number("local_classifier_threshold", LOCAL_CLASSIFIER_THRESHOLD)
 
+        # 整批一次查库去重，同一批内重复的 message_id 也只保留一封
+        seen = db.existing_message_ids([item["message_id"] for item in emails if item["message_id"]])
+        now = datetime.utcnow().isoformat()
+        rows = []
         for item in emails:
-            if db.fetch_one("SELECT 1 FROM emails WHERE message_id = ?", (item["message_id"],)):
-                logger.info(f"Email {item['message_id']} already exists, skipping")
-                continue
+            if item["message_id"]:
+                if item["message_id"] in seen:
+                    logger.info(f"Email {item['message_id']} already exists, skipping")
+                    continue
+                seen.add(item["message_id"])
             language = detect_language(item["body_text"] or item["subject"])
             translation = None
             if language and language.lower() not in ("zh", "zh-cn"):
@@ -89,49 +258,34 @@ class EmailPoller:
                 text_to_translate = text_to_translate.strip()[:2000]  # 限制长度
                 translation = translate_baidu(text_to_translate, baidu_appid, baidu_secret, target_lang)
 
-            # 保存邮件获取ID
-            email_id = db.execute(
-                """
-                INSERT INTO emails
-                (message_id, sender, subject, body_text, body_html, received_at, language, translation, status, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?)
-                """,
-                (
-                    item["message_id"],
-                    item["sender"],
-                    item["subject"],
-                    item["body_text"],
-                    item["body_html"],
-                    item["received_at"],
-                    language,
-                    translation,
-                    datetime.utcnow().isoformat(),
-                ),
-            )
-
-            # 获取刚插入的邮件记录
-            email_row = db.fetch_one("SELECT * FROM emails WHERE id = ?", (email_id,))
-            if not email_row:
-                logger.warning(f"Failed to retrieve inserted email {email_id}")
-                continue
+            row = {
+                "message_id": item["message_id"],
+                "account_id": account["id"],
+                "sender": item["sender"],
+                "subject": item["subject"],
+                "body_text": item["body_text"],
+                "body_html": item["body_html"],
+                "attachments": json.dumps(item.get("attachments") or [], ensure_ascii=False),
+                "received_at": item["received_at"],
+                "language": language,
+                "translation": translation,
+                "status": "pending",
+                "created_at": now,
+            }
 
-            # 自动分类
-            email_text = email_row["body_text"] or email_row["subject"]
+            # 自动分类，入库前在内存里完成
+            email_text = row["body_text"] or row["subject"]
             if categories:
                 category, confidence, method, reason = classify_email(
-                    email_text, categories, ai_key, base_url, model
+                    email_text, categories, ai_key, base_url, model, local_threshold
                 )
 
                 # 尝试生成 AI 回复（模板或 AI）
                 reply = None
-                template_row = db.fetch_one(
-                    "SELECT * FROM templates WHERE category_id = ? ORDER BY id DESC LIMIT 1",
-                    (category["id"],),
-                )
-                if template_row:
-                    template_dict = dict(template_row)
+                template_dict = config.latest_template(category["id"])
+                if template_dict:
                     variables = build_variables(
-                        dict(email_row),
+                        row,
                         template_dict.get("variables"),
                         company_name="Your Fashion Store",
                         company_email="support@yourfashion.com",
@@ -139,14 +293,37 @@ class EmailPoller:
                     )
                     reply = render_template(template_dict["content"], variables)
 
-                # 更新邮件的分类和 AI 回复
-                db.execute(
-                    "UPDATE emails SET category_id = ?, confidence = ?, ai_reply = ? WHERE id = ?",
-                    (category["id"], confidence, reply, email_id),
-                )
+                row.update(category_id=category["id"], confidence=confidence, ai_reply=reply)
+                logger.info(f"Auto-classified email: {category['name']} ({method}, confidence: {confidence:.2f})")
+
+            rows.append(row)
+
+        # 整批邮件和 UID 水位在同一个写操作里提交；中途失败时下次轮询会重新拉取
+        def store(conn) -> dict:
+            inserted = db.insert_emails(rows)
+            db.set_sync_state(account["id"], "INBOX", uidvalidity, last_uid)
+            return inserted
+
+        inserted = db.write(store)
+        logger.info(f"Successfully processed {len(emails)} email(s), saved {len(inserted)}")
+
+
+def _resolve(waiters: List[asyncio.Future], error: Optional[Exception] = None) -> None:
+    for future in waiters:
+        if future.done():
+            continue
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
 
-                logger.info(f"Auto-classified email {email_id}: {category['name']} ({method}, confidence: {confidence:.2f})")
+async def _wait(event: asyncio.Event, timeout: float) -> None:
+    """等待 timeout 秒，事件被设置时提前返回"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
 
-            logger.info(f"Saved email: {item['subject'][:50] if item['subject'] else 'No subject'}")
 
-        logger.info(f"Successfully processed {len(emails)} email(s)")
+email_poller = EmailPoller()
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from ..db import db
+from ..services.config_cache import config_cache
+
+logger = logging.getLogger(__name__)
+
+# 两次归档之间的间隔
+RETENTION_CHECK_SECONDS = 6 * 60 * 60
+# 未配置 retention_days 时的保留天数
+RETENTION_DEFAULT_DAYS = 90
+
+
+def _retention_days() -> int:
+    try:
+        return int(config_cache.get().setting("retention_days", str(RETENTION_DEFAULT_DAYS)) or 0)
+    except ValueError:
+        return RETENTION_DEFAULT_DAYS
+
+
+class RetentionJob:
+    """
+    后台归档任务。
+    定期把超过 retention_days 天的已发送、已删除邮件移到 archive.db，热库只保留近期数据；
+    retention_days 为 0 时不归档。归档后的邮件仍可通过详情和搜索接口查到。
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+    async def start(self) -> None:
+        if self._task:
+            return
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._running = False
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def run_once(self) -> int:
+        days = _retention_days()
+        if days <= 0:
+            return 0
+        before = (datetime.utcnow() - timedelta(days=days)).isoformat()
+        moved = await asyncio.to_thread(db.archive_emails, before)
+        if moved:
+            logger.info(f"Archived {moved} email(s) received before {before}")
+        return moved
+
+    async def _run(self) -> None:
+        while self._running:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Retention job failed: {e}")
+            await asyncio.sleep(RETENTION_CHECK_SECONDS)
+
+
+retention_job = RetentionJob()
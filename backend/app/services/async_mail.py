@@ -0,0 +1,333 @@
+"""
+asyncio 原生的 IMAP 传输和增量拉取流程。
+基于 asyncio.open_connection，可在事件循环中直接 await，大量账号并发拉取不再各占一个线程；
+后台轮询和手动同步都走每个账号调度任务持有的这一个连接。
+发信走 outbox 后台任务和 smtp_pool 的连接池。
+"""
+import asyncio
+import logging
+import re
+import ssl
+import time
+from typing import AsyncIterator, Callable, List, Optional
+
+from .email_client import (
+    FETCH_BATCH_SIZE,
+    HEADER_FETCH_ITEMS,
+    IDLE_REFRESH_SECONDS,
+    STRUCTURE_FETCH_ITEMS,
+    IMAPError,
+    _EXISTS_RE,
+    _FETCH_RE,
+    _LITERAL_RE,
+    _group_by_sections,
+    _header_message_id,
+    _parse_fetch_items,
+    _part_items,
+    _structure_parts,
+    _submit_text_record,
+    _uid_set,
+)
+from .mime_parser import submit_parse
+
+logger = logging.getLogger(__name__)
+
+# 单行响应上限（StreamReader 默认 64 KB，SEARCH 结果可能更长）
+_LINE_LIMIT = 4 * 1024 * 1024
+# literal 分块读取，超时作用于每次读取，大附件下载时间再长也不会被整体超时打断
+_LITERAL_CHUNK = 256 * 1024
+
+
+class AsyncIMAPClient:
+    """asyncio 版 IMAP 客户端"""
+
+    def __init__(self, host: str, port: int, use_ssl: bool = True):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.uidvalidity: Optional[int] = None
+        self.uidnext: Optional[int] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tag_seq = 0
+
+    def _next_tag(self) -> str:
+        self._tag_seq += 1
+        return f"A{self._tag_seq:04d}"
+
+    async def _read_line(self, timeout: Optional[float] = None) -> bytes:
+        return (await asyncio.wait_for(self._reader.readuntil(b"\r\n"), timeout))[:-2]
+
+    async def _read_literal(self, size: int, timeout: float) -> bytes:
+        chunks = []
+        while size:
+            chunk = await asyncio.wait_for(self._reader.read(min(size, _LITERAL_CHUNK)), timeout)
+            if not chunk:
+                raise ConnectionError("IMAP connection closed by server")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    async def _read_response(self, timeout: float) -> tuple[list[bytes], list[bytes]]:
+        """读取一条完整响应，literal 按 {n} 字节数读取；timeout 作用于每次读取而不是整条响应"""
+        segments, literals = [], []
+        while True:
+            line = await self._read_line(timeout)
+            segments.append(line)
+            match = _LITERAL_RE.search(line)
+            if not match:
+                return segments, literals
+            literals.append(await self._read_literal(int(match.group(1)), timeout))
+
+    async def _send(self, line: bytes) -> None:
+        self._writer.write(line)
+        await self._writer.drain()
+
+    async def _responses(self, command: str, timeout: float = 15.0, check: bool = True) -> AsyncIterator[tuple[list[bytes], list[bytes]]]:
+        tag = self._next_tag()
+        await self._send(f"{tag} {command}\r\n".encode())
+        prefix = tag.encode() + b" "
+        while True:
+            segments, literals = await self._read_response(timeout)
+            if segments[0].startswith(prefix):
+                status = segments[0][len(prefix):]
+                if check and not status.upper().startswith(b"OK"):
+                    raise IMAPError(f"{command.split(' ', 1)[0]} failed: {status.decode('latin-1')}")
+                return
+            yield segments, literals
+
+    async def _command(self, command: str, timeout: float = 15.0, check: bool = True) -> list[bytes]:
+        return [segments[0] async for segments, _ in self._responses(command, timeout, check)]
+
+    async def connect(self, timeout: float = 30.0) -> None:
+        context = ssl._create_unverified_context() if self.use_ssl else None
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=context,
+                server_hostname=self.host if context else None,
+                limit=_LINE_LIMIT,
+            ),
+            timeout,
+        )
+        await self._read_line(timeout)
+
+    async def login(self, username: str, password: str) -> None:
+        try:
+            await self._command(f"LOGIN {username} {password}")
+        except IMAPError as e:
+            raise Exception(f"Login failed: {e}")
+
+    async def send_id(self, username: str) -> None:
+        cmd = f'ID ("name" "SupportMail" "version" "1.0" "vendor" "Support" "support-email" "{username}")'
+        await self._command(cmd, check=False)
+
+    async def noop(self) -> None:
+        for line in await self._command("NOOP"):
+            if line.upper().startswith(b"* BYE"):
+                raise IMAPError(f"Server closed session: {line.decode('latin-1')}")
+
+    async def capabilities(self) -> set[str]:
+        caps = set()
+        for line in await self._command("CAPABILITY"):
+            if line.upper().startswith(b"* CAPABILITY"):
+                caps.update(line[12:].decode("ascii", errors="ignore").upper().split())
+        return caps
+
+    async def select_inbox(self, folder: str = "INBOX") -> int:
+        resp = b"\r\n".join(await self._command(f"SELECT {folder}"))
+        match = re.search(rb'\[UIDVALIDITY (\d+)\]', resp)
+        self.uidvalidity = int(match.group(1)) if match else None
+        match = re.search(rb'\[UIDNEXT (\d+)\]', resp)
+        self.uidnext = int(match.group(1)) if match else None
+        match = re.search(rb'\* (\d+) EXISTS', resp)
+        return int(match.group(1)) if match else 0
+
+    async def uid_search_since(self, last_uid: int) -> List[int]:
+        uids = []
+        for line in await self._command(f"UID SEARCH UID {last_uid + 1}:*"):
+            if line.upper().startswith(b"* SEARCH"):
+                uids.extend(int(uid) for uid in line[8:].split() if uid.isdigit())
+        # "n:*" 在没有新邮件时仍会返回当前最大 UID，需要过滤
+        return [uid for uid in uids if uid > last_uid]
+
+    async def uid_fetch(self, uid_set: str, items: str = "(UID RFC822.SIZE BODY.PEEK[])", timeout: float = 60.0) -> AsyncIterator[dict]:
+        """批量 UID FETCH，逐封 yield；调用方需消费完，否则连接上会残留未读的响应"""
+        async for segments, literals in self._responses(f"UID FETCH {uid_set} {items}", timeout):
+            match = _FETCH_RE.match(segments[0])
+            if match:
+                yield _parse_fetch_items(segments, literals, match.end())
+
+    async def idle(self, timeout: float = IDLE_REFRESH_SECONDS, wake: Optional[asyncio.Event] = None) -> bool:
+        """
+        IDLE 等待服务器推送（RFC 2177）。
+        收到 EXISTS 或 wake 被设置（手动同步）时结束并返回 True；到 timeout 仍无新邮件返回 False，
+        调用方应重新发起 IDLE（服务器会在 29 分钟后断开闲置的 IDLE）。
+        """
+        tag = self._next_tag()
+        prefix = tag.encode() + b" "
+        await self._send(f"{tag} IDLE\r\n".encode())
+        while True:
+            line = await self._read_line(15)
+            if line.startswith(b"+"):
+                break
+            if line.startswith(prefix):
+                raise IMAPError(f"IDLE failed: {line.decode('latin-1')}")
+
+        has_new = False
+        deadline = time.monotonic() + timeout
+        waker = asyncio.ensure_future(wake.wait()) if wake else None
+        reading: Optional[asyncio.Future] = None
+        try:
+            while not has_new:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                reading = asyncio.ensure_future(self._read_line())
+                await asyncio.wait({reading, waker} if waker else {reading}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not reading.done():
+                    # readuntil 被取消时已收到的字节留在缓冲区，DONE 之后照常读出
+                    reading.cancel()
+                    await asyncio.wait({reading})
+                if reading.cancelled():
+                    has_new = bool(waker and waker.done())
+                    break
+                line = reading.result()
+                if line.upper().startswith(b"* BYE"):
+                    raise IMAPError(f"Server closed IDLE: {line.decode('latin-1')}")
+                has_new = bool(_EXISTS_RE.match(line))
+        finally:
+            for task in (reading, waker):
+                if task and not task.done():
+                    task.cancel()
+        await self._send(b"DONE\r\n")
+        while True:
+            segments, _ = await self._read_response(15)
+            if segments[0].startswith(prefix):
+                return has_new
+            has_new = has_new or bool(_EXISTS_RE.match(segments[0]))
+
+    async def close(self) -> None:
+        if not self._writer:
+            return
+        try:
+            self._writer.write(f"{self._next_tag()} LOGOUT\r\n".encode())
+            await asyncio.wait_for(self._writer.drain(), 5)
+        except Exception:
+            pass
+        self._writer.close()
+        try:
+            await asyncio.wait_for(self._writer.wait_closed(), 5)
+        except Exception:
+            pass
+        self._writer = None
+
+
+async def open_mailbox_async(host: str, port: int, username: str, password: str, use_ssl: bool = True, folder: str = "INBOX") -> AsyncIMAPClient:
+    """建立连接、登录并选中文件夹"""
+    mail = AsyncIMAPClient(host, port, use_ssl)
+    try:
+        await mail.connect()
+        await mail.login(username, password)
+        await mail.send_id(username)
+        await mail.select_inbox(folder)
+    except Exception as e:
+        logger.error(f"IMAP failed: {e}")
+        await mail.close()
+        raise ValueError(f"IMAP failed: {e}")
+    return mail
+
+
+async def iter_mailbox_async(
+    mail: AsyncIMAPClient,
+    uidvalidity: Optional[int] = None,
+    last_uid: int = 0,
+    known_ids: Optional[Callable[[list[str]], set[str]]] = None,
+    text_only: bool = True,
+    part_limit: Optional[int] = None,
+) -> AsyncIterator[tuple[list[dict], Optional[int], int]]:
+    """
+    在已选中文件夹的连接上拉取 UID 水位之后的新邮件，每批（FETCH_BATCH_SIZE 封）yield 一次。
+    yield: (emails, uidvalidity, last_uid)，last_uid 为该批处理完后的水位，调用方可逐批入库并推进水位，
+    内存占用只与批大小有关，与邮箱大小无关。
+    服务器 UIDVALIDITY 与本地记录不一致时，旧的 UID 水位失效，从头同步一次。
+    传入 known_ids（同步函数，在线程中执行）时先只拉取头部，按 Message-ID 去重后再下载正文。
+    text_only 时先取 BODYSTRUCTURE，只下载正文分段（可按 part_limit 截断），附件只记录元数据。
+    """
+    if uidvalidity is not None and mail.uidvalidity != uidvalidity:
+        logger.warning(f"UIDVALIDITY changed ({uidvalidity} -> {mail.uidvalidity}), resyncing")
+        last_uid = 0
+
+    start_uid = last_uid
+    uids = await mail.uid_search_since(last_uid)
+    if not uids:
+        # 没有新邮件也 yield 一次，让调用方记录（可能已重置的）水位
+        yield [], mail.uidvalidity, last_uid
+    total = 0
+    skipped, skipped_bytes = 0, 0
+    # 每批一条 UID FETCH，省去逐封往返
+    for i in range(0, len(uids), FETCH_BATCH_SIZE):
+        batch = uids[i:i + FETCH_BATCH_SIZE]
+        wanted = batch
+        emails = []
+        headers: dict = {}
+        if known_ids or text_only:
+            # 第一阶段：只取头部（和 BODYSTRUCTURE），整批一次查库去重
+            items = STRUCTURE_FETCH_ITEMS if text_only else HEADER_FETCH_ITEMS
+            headers = {fetched.get("UID"): fetched async for fetched in mail.uid_fetch(_uid_set(batch), items)}
+        if known_ids:
+            message_ids = {uid: _header_message_id(fetched) for uid, fetched in headers.items()}
+            seen = await asyncio.to_thread(known_ids, [mid for mid in message_ids.values() if mid])
+            wanted = [uid for uid in batch if message_ids.get(uid) is None or message_ids[uid] not in seen]
+            skipped += len(batch) - len(wanted)
+            skipped_bytes += sum(headers[uid].get("RFC822.SIZE") or 0 for uid in batch if uid in headers and uid not in wanted)
+
+        # 第二阶段：只下载正文分段
+        if wanted and text_only:
+            plans = {uid: _structure_parts(headers[uid].get("BODYSTRUCTURE")) for uid in wanted if uid in headers}
+            decoding = []
+            for sections, group in _group_by_sections(plans).items():
+                parts = {}
+                if sections:
+                    parts = {fetched.get("UID"): fetched async for fetched in mail.uid_fetch(_uid_set(group), _part_items(sections, part_limit))}
+                # 头部和正文分段在进程池中解码，不阻塞事件循环，并与下一组的下载重叠进行
+                decoding.extend(
+                    (uid, asyncio.wrap_future(_submit_text_record(headers[uid], plans[uid], parts.get(uid, {}))))
+                    for uid in group
+                )
+            emails.extend(await _collect(decoding))
+            # 结构无法识别的邮件整封下载
+            wanted = [uid for uid in wanted if plans.get(uid) is None]
+
+        # 整封下载，解析交给进程池，与后续下载重叠进行
+        if wanted:
+            parsing = [
+                (fetched.get("UID"), asyncio.wrap_future(submit_parse(fetched["BODY[]"])))
+                async for fetched in mail.uid_fetch(_uid_set(wanted))
+                if fetched.get("BODY[]") is not None
+            ]
+            emails.extend(await _collect(parsing))
+        # 解析失败的邮件同样推进水位，避免每次轮询都卡在同一封上
+        last_uid = max(last_uid, batch[-1])
+        total += len(emails)
+        yield emails, mail.uidvalidity, last_uid
+
+    if skipped:
+        logger.info(f"Skipped {skipped} known emails ({skipped_bytes // 1024} KB not downloaded)")
+    logger.info(f"Fetched {total} emails (UID > {start_uid})")
+
+
+async def _collect(parsing: list[tuple[int, asyncio.Future]]) -> list[dict]:
+    """等待解析结果并标上 UID；解析失败的邮件记录日志后跳过"""
+    emails = []
+    for uid, future in parsing:
+        try:
+            item = await future
+        except Exception as e:
+            logger.error(f"Failed to parse email UID {uid}, skipped: {e}")
+            continue
+        item["uid"] = uid
+        emails.append(item)
+        logger.info(f"Got email: {item['subject'][:50]}")
+    return emails
@@ -1,16 +1,18 @@
 from typing import Dict, List, Optional, Tuple
 
 from .ai_client import classify_email_ai
+from .keyword_matcher import matcher_for
+from .local_classifier import DEFAULT_THRESHOLD, local_classifier
 
 
 def _keyword_match(text: str, categories: List[Dict]) -> Optional[Tuple[Dict, float]]:
-    lowered = text.lower()
+    # 所有分类的关键词编译成一个自动机，扫描一遍文本；同分时取优先级靠前的分类
+    if not categories:
+        return None
     best = None
-    for cat in categories:
-        keywords = [k.strip().lower() for k in (cat.get("keywords") or "").split(",") if k.strip()]
-        score = sum(1 for k in keywords if k in lowered)
+    for cat, score in zip(categories, matcher_for(categories).scores(text)):
         if score > 0 and (best is None or score > best[1]):
-            best = (cat, float(score))
+            best = (cat, score)
     if best:
         confidence = min(0.95, 0.6 + best[1] * 0.1)
         return best[0], confidence
@@ -30,11 +32,13 @@ def classify_email(
     api_key: str,
     base_url: str,
     model: str,
+    local_threshold: float = DEFAULT_THRESHOLD,
 ) -> Tuple[Dict, float, str, str]:
     """
     分类邮件。
+    local_threshold: 本地模型置信度达到该值才采用，否则交给 AI；0 表示不使用本地模型
     返回: (category_dict, confidence, method, reason)
-    method: "keyword" | "ai"
+    method: "keyword" | "local" | "ai" | "default"
     reason: 分类原因说明
     """
     # 第一步：关键词匹配（优先级最高）
@@ -42,7 +46,13 @@ def classify_email(
     if keyword_hit:
         return keyword_hit[0], keyword_hit[1], "keyword", "关键词命中"
 
-    # 第二步：AI 语义分类
+    # 第二步：本地模型（从客服已发送回复的分类中学习）
+    if local_threshold > 0:
+        local_hit = local_classifier.predict(text, categories)
+        if local_hit and local_hit[1] >= local_threshold:
+            return local_hit[0], local_hit[1], "local", "本地模型根据历史处理记录判断"
+
+    # 第三步：AI 语义分类
     ai_result = classify_email_ai(api_key, text, categories, base_url, model)
     if ai_result:
         category_id = ai_result["category_id"]
@@ -0,0 +1,83 @@
+import threading
+from typing import Dict, List, Optional
+
+from ..db import db
+from .keyword_matcher import parse_keywords
+
+
+class ConfigSnapshot:
+    """
+    某个版本的配置快照，只读，可在线程间共享。
+    categories 按 priority 降序，每个分类带解析好的 keyword_list；
+    templates 按 category_id 分组，组内按 id 降序（第一个是最新的模板）。
+    """
+
+    def __init__(self, version: int, settings: Dict[str, str], categories: List[Dict], templates: List[Dict]) -> None:
+        self.version = version
+        self.settings = settings
+        self.categories = categories
+        self.templates = templates
+        self.templates_by_category: Dict[int, List[Dict]] = {}
+        for template in templates:
+            self.templates_by_category.setdefault(template["category_id"], []).append(template)
+
+    def setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.settings.get(key, default)
+
+    def number(self, key: str, default: float) -> float:
+        """数值配置，未配置或格式错误时返回 default"""
+        try:
+            return float(self.settings.get(key) or default)
+        except ValueError:
+            return default
+
+    def latest_template(self, category_id: int) -> Optional[Dict]:
+        templates = self.templates_by_category.get(category_id)
+        return templates[0] if templates else None
+
+    def category(self, category_id: Optional[int]) -> Optional[Dict]:
+        return next((c for c in self.categories if c["id"] == category_id), None)
+
+
+class ConfigCache:
+    """
+    进程级配置缓存：settings、categories、templates。
+    设置、分类、模板接口写入后调用 bump() 使版本号加一，下一次 get() 时重新加载；
+    版本号不变时直接返回快照，不查库。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot: Optional[ConfigSnapshot] = None
+
+    def bump(self) -> None:
+        with self._lock:
+            self._version += 1
+
+    def get(self) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self._version:
+            return snapshot
+        with self._lock:
+            version = self._version
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            # 加载期间再次 bump 时版本号不一致，下一次 get() 会重新加载
+            snapshot = self._load(version)
+            self._snapshot = snapshot
+            return snapshot
+
+    @staticmethod
+    def _load(version: int) -> ConfigSnapshot:
+        categories = []
+        for row in db.fetch_all("SELECT * FROM categories ORDER BY priority DESC"):
+            category = dict(row)
+            category["keyword_list"] = parse_keywords(category.get("keywords"))
+            categories.append(category)
+        templates = [dict(row) for row in db.fetch_all("SELECT * FROM templates ORDER BY id DESC")]
+        return ConfigSnapshot(version, db.get_settings(), categories, templates)
+
+
+config_cache = ConfigCache()
@@ -1,257 +1,207 @@
+"""
+IMAP 协议解析（FETCH 响应、BODYSTRUCTURE）和回复邮件构造。
+传输与拉取流程见 async_mail。
+"""
 import email
-import logging
-import socket
-import ssl
-import smtplib
 import re
-from email.header import decode_header
-from email.message import Message
+from concurrent.futures import Future
 from email.mime.text import MIMEText
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
-logger = logging.getLogger(__name__)
+from .mime_parser import submit_text_record
 
+FETCH_BATCH_SIZE = 100
+HEADER_FETCH_ITEMS = "(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID FROM SUBJECT DATE)])"
+STRUCTURE_FETCH_ITEMS = "(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID FROM SUBJECT DATE)])"
+# RFC 2177：服务器可在 IDLE 30 分钟后断开，客户端需在此之前重新发起
+IDLE_REFRESH_SECONDS = 25 * 60
+# IDLE 连接断开后的重连间隔
+IMAP_IDLE_RETRY_SECONDS = 30
 
-class IMAPClient:
-    """简化的 IMAP 客户端"""
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_EXISTS_RE = re.compile(rb'\* \d+ EXISTS', re.IGNORECASE)
+_FETCH_RE = re.compile(rb'\* \d+ FETCH \(', re.IGNORECASE)
+# 原子内允许 [section]<partial>，如 BODY[HEADER.FIELDS (FROM)]<0>
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:\\.|[^"\\])*)"|([^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?))')
 
-    def __init__(self, host: str, port: int):
-        self.host = host
-        self.port = port
-        self.sock = None
 
-    def _recv_until_tag(self, tag: str, timeout: float = 15.0) -> str:
-        import time
-        start = time.time()
-        data = b''
+class IMAPError(Exception):
+    """IMAP 命令返回 NO/BAD 或连接异常"""
 
-        while time.time() - start < timeout:
-            try:
-                self.sock.settimeout(timeout - (time.time() - start))
-                chunk = self.sock.recv(8192)
-                if not chunk:
-                    break
-                data += chunk
-                if tag.encode() in data:
-                    break
-            except socket.timeout:
+
+_OPEN, _CLOSE = object(), object()
+
+
+def _tokenize(segments: list[bytes], literals: list[bytes], offset: int) -> Iterator:
+    for i, segment in enumerate(segments):
+        text = segment[offset:] if i == 0 else segment
+        if i < len(literals):
+            text = text[:_LITERAL_RE.search(text).start()]
+        pos = 0
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
                 break
+            pos = match.end()
+            if match.group(1):
+                yield _OPEN
+            elif match.group(2):
+                yield _CLOSE
+            elif match.group(3) is not None:
+                yield re.sub(rb'\\(.)', rb'\1', match.group(3)).decode("utf-8", errors="replace")
+            elif match.group(4) is not None:
+                atom = match.group(4).decode("latin-1")
+                yield None if atom.upper() == "NIL" else atom
+        if i < len(literals):
+            yield literals[i]
+
+
+def _parse_list(tokens: Iterator) -> list:
+    items = []
+    for token in tokens:
+        if token is _OPEN:
+            items.append(_parse_list(tokens))
+        elif token is _CLOSE:
+            return items
+        else:
+            items.append(token)
+    return items
+
+
+def _parse_fetch_items(segments: list[bytes], literals: list[bytes], offset: int) -> dict:
+    """解析 FETCH 响应中的属性列表，literal 以 bytes 原样返回"""
+    values = _parse_list(_tokenize(segments, literals, offset))
+    result = {}
+    for key, value in zip(values[0::2], values[1::2]):
+        key = str(key).upper()
+        if key in ("UID", "RFC822.SIZE") and value is not None:
+            value = int(value)
+        elif isinstance(value, str) and key.startswith(("BODY[", "RFC822")):
+            value = value.encode("utf-8")
+        result[key] = value
+    return result
+
+
+def _uid_set(uids: List[int]) -> str:
+    """将 UID 列表压缩为 IMAP 序列集，如 [1,2,3,7] -> "1:3,7" """
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
 
-        return data.decode('latin-1', errors='ignore')
-
-    def connect(self):
-        self.sock = socket.create_connection((self.host, self.port), timeout=30)
-        self.sock = ssl._create_unverified_context().wrap_socket(self.sock, server_hostname=self.host)
-        self.sock.recv(4096)
-
-    def login(self, username: str, password: str):
-        tag = "LOG1"
-        self.sock.sendall(f"{tag} LOGIN {username} {password}\r\n".encode())
-        resp = self._recv_until_tag(tag)
-        if 'OK' not in resp:
-            raise Exception(f"Login failed: {resp}")
-
-    def send_id(self, username: str):
-        tag = "ID01"
-        cmd = f'ID ("name" "SupportMail" "version" "1.0" "vendor" "Support" "support-email" "{username}")'
-        self.sock.sendall(f"{tag} {cmd}\r\n".encode())
-        resp = self._recv_until_tag(tag)
-        logger.info(f"IMAP ID: {resp[:100]}")
-
-    def select_inbox(self) -> int:
-        tag = "SELE"
-        self.sock.sendall(f"{tag} SELECT INBOX\r\n".encode())
-        resp = self._recv_until_tag(tag)
-        match = re.search(r'\* (\d+) EXISTS', resp)
-        return int(match.group(1)) if match else 0
-
-    def search_all(self) -> List[str]:
-        """搜索所有邮件"""
-        tag = "SEA1"
-        self.sock.sendall(f"{tag} SEARCH ALL\r\n".encode())
-        resp = self._recv_until_tag(tag)
-        match = re.search(r'\* SEARCH (.+?)\r?\n', resp)
-        if match:
-            ids = match.group(1).strip().split()
-            if ids:
-                return ids
-        return []
-
-    def search_unseen(self) -> List[str]:
-        """搜索未读邮件"""
-        tag = "SEA2"
-        self.sock.sendall(f"{tag} SEARCH UNSEEN\r\n".encode())
-        resp = self._recv_until_tag(tag)
-        match = re.search(r'\* SEARCH (.+?)\r?\n', resp)
-        if match:
-            ids = match.group(1).strip().split()
-            if ids:
-                return ids
-        return []
-
-    def fetch_email(self, email_id: str) -> Optional[Message]:
-        tag = "FET1"
-        self.sock.sendall(f"{tag} FETCH {email_id} RFC822\r\n".encode())
-        resp = self._recv_until_tag(tag)
-
-        # 网易格式: * N FETCH (RFC822 {size}\r\n<content>\r\n)
-        # 或标准格式: * N FETCH (RFC822 {size})\r\n<content>
-        # 尝试多种匹配模式
-
-        # 模式1: 网易格式 (RFC822 {size}
-        match = re.search(r'\* \d+ FETCH \(RFC822 (\d+)\}\r?\n', resp)
-        if match:
-            size = int(match.group(1))
-            # 找到邮件内容开始位置
-            content_start = match.end()
-            content = resp[content_start:content_start + size]
-            try:
-                return email.message_from_bytes(content.encode('latin-1'))
-            except:
-                pass
-
-        # 模式2: 尝试直接查找 {size}
-        match = re.search(r'RFC822 \{(\d+)\}\r?\n', resp)
-        if match:
-            size = int(match.group(1))
-            content_start = match.end()
-            content = resp[content_start:content_start + size]
-            try:
-                return email.message_from_bytes(content.encode('latin-1'))
-            except:
-                pass
-
-        # 模式3: 找到 FETCH ( 之后的内容
-        match = re.search(r'FETCH \(.*?\{(\d+)\}\r?\n', resp, re.DOTALL)
-        if match:
-            size = int(match.group(1))
-            content_start = match.end()
-            content = resp[content_start:content_start + size]
-            try:
-                return email.message_from_bytes(content.encode('latin-1'))
-            except:
-                pass
 
+def _header_bytes(fetched: dict) -> Optional[bytes]:
+    return next((value for key, value in fetched.items() if key.startswith("BODY[HEADER")), None)
+
+
+def _header_message_id(fetched: dict) -> Optional[str]:
+    raw = _header_bytes(fetched)
+    if not raw:
         return None
+    return email.message_from_bytes(raw).get("Message-ID")
 
-    def close(self):
-        if self.sock:
-            try:
-                self.sock.sendall(b"LOG1 LOGOUT\r\n")
-                self.sock.recv(1024)
-            except:
-                pass
-            self.sock.close()
-
-
-def _decode_subject(subject: str) -> str:
-    decoded_parts = decode_header(subject)
-    return ''.join(p.decode(e or 'utf-8', errors='ignore') if isinstance(p, bytes) else p for p, e in decoded_parts)
-
-
-def _decode_sender(sender: str) -> str:
-    """Decode sender field, handling encoded names and email addresses"""
-    if not sender:
-        return ""
-    decoded_parts = decode_header(sender)
-    parts = []
-    for part, encoding in decoded_parts:
-        if isinstance(part, bytes):
-            parts.append(part.decode(encoding or 'utf-8', errors='ignore'))
-        else:
-            parts.append(part)
-    return ''.join(parts)
-
-
-def _extract_body(msg: Message) -> tuple[str, str]:
-    text_parts, html_parts = [], []
-    if msg.is_multipart():
-        for part in msg.walk():
-            ct = part.get_content_type()
-            if ct == "text/plain" and not part.get("Content-Disposition"):
-                text_parts.append((part.get_payload(decode=True) or b"").decode(part.get_content_charset() or 'utf-8', errors='ignore'))
-            elif ct == "text/html" and not part.get("Content-Disposition"):
-                html_parts.append((part.get_payload(decode=True) or b"").decode(part.get_content_charset() or 'utf-8', errors='ignore'))
-    else:
-        text_parts.append((msg.get_payload(decode=True) or b"").decode(msg.get_content_charset() or 'utf-8', errors='ignore'))
-    return '\n'.join(text_parts).strip(), '\n'.join(html_parts).strip()
-
-
-def _parse_date(date_str: str) -> str:
-    """Parse RFC 2822 date string to ISO 8601 format"""
-    from datetime import datetime
-    import email.utils
-    
-    if not date_str:
-        return datetime.utcnow().isoformat()
-    
-    try:
-        dt = email.utils.parsedate_to_datetime(date_str)
-        return dt.isoformat()
-    except Exception:
-        # Fallback to current time if parsing fails
-        return datetime.utcnow().isoformat()
 
+def _params(value) -> dict:
+    if not isinstance(value, list):
+        return {}
+    return {str(k).lower(): v for k, v in zip(value[0::2], value[1::2]) if isinstance(v, str)}
 
-def fetch_unreplied(host: str, port: int, username: str, password: str, use_ssl: bool = True) -> list[dict]:
-    mail = IMAPClient(host, port)
 
+def _structure_parts(structure, section: str = "") -> Optional[tuple[list[dict], list[dict]]]:
+    """
+    按 BODYSTRUCTURE 找出正文分段与附件。
+    返回: (text_parts, attachments)，结构无法识别时返回 None（整封下载）。
+    text_parts 与 mime_parser._walk_parts 口径一致：multipart 中没有 Content-Disposition 的 text/plain、text/html；
+    单分段邮件不论 Content-Disposition（mutt 默认带 inline）都整段作为 body_text：
+    text/plain 只下载该分段，其他类型返回 None，整封下载后解析。
+    """
+    if not isinstance(structure, list) or not structure:
+        return None
     try:
-        mail.connect()
-        mail.login(username, password)
-        mail.send_id(username)
-        mail.select_inbox()
-    except Exception as e:
-        logger.error(f"IMAP failed: {e}")
-        mail.close()
-        raise ValueError(f"IMAP failed: {e}")
-
-    # 先尝试搜索未读邮件
-    email_ids = mail.search_unseen()
-    search_type = "UNSEEN"
-
-    # 如果没有未读邮件,搜索所有邮件
-    if not email_ids:
-        logger.info("No unseen emails found, searching all emails...")
-        email_ids = mail.search_all()
-        search_type = "ALL"
-
-    if not email_ids:
-        mail.close()
-        return []
-
-    emails = []
-    for eid in email_ids:
-        msg = mail.fetch_email(eid)
-        if msg:
-            emails.append({
-                "message_id": msg.get("Message-ID"),
-                "sender": _decode_sender(msg.get("From", "")),
-                "subject": _decode_subject(msg.get("Subject", "")),
-                "received_at": _parse_date(msg.get("Date")),
-                "body_text": _extract_body(msg)[0],
-                "body_html": _extract_body(msg)[1],
-            })
-            logger.info(f"Got email: {emails[-1]['subject'][:50]}")
-
-    mail.close()
-    logger.info(f"Fetched {len(emails)} emails (search: {search_type})")
-    return emails
-
-
-def send_reply(host: str, port: int, username: str, password: str, to_addr: str, subject: str, body: str, use_ssl: bool = True) -> Optional[str]:
+        if isinstance(structure[0], list):
+            text_parts, attachments = [], []
+            # multipart：开头连续的列表是子分段，之后是 subtype 和扩展字段
+            children = []
+            for child in structure:
+                if not isinstance(child, list):
+                    break
+                children.append(child)
+            for i, child in enumerate(children):
+                result = _structure_parts(child, f"{section}.{i + 1}" if section else str(i + 1))
+                if result is None:
+                    return None
+                text_parts.extend(result[0])
+                attachments.extend(result[1])
+            return text_parts, attachments
+
+        maintype, subtype = str(structure[0]).lower(), str(structure[1]).lower()
+        params = _params(structure[2])
+        encoding = str(structure[5] or "7bit").lower()
+        size = int(structure[6] or 0)
+        if encoding == "base64":
+            # BODYSTRUCTURE 给的是编码后的大小，和 _encoded_size 一样按解码后估算
+            size = size * 3 // 4
+        # 扩展字段位置：text 多一个 lines，message/rfc822 多 envelope、body、lines
+        if maintype == "text":
+            ext = 8
+        elif (maintype, subtype) == ("message", "rfc822"):
+            ext = 10
+        else:
+            ext = 7
+        disposition = structure[ext + 1] if len(structure) > ext + 1 else None
+        part_section = section or "1"
+        if not section:
+            if (maintype, subtype) != ("text", "plain"):
+                return None
+            disposition = None
+        if disposition is None and maintype == "text" and subtype in ("plain", "html"):
+            return [{
+                "section": part_section,
+                "subtype": subtype,
+                "encoding": encoding,
+                "charset": params.get("charset"),
+            }], []
+        disposition_params = _params(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else {}
+        return [], [{
+            "filename": disposition_params.get("filename") or params.get("name") or "",
+            "content_type": f"{maintype}/{subtype}",
+            "size": size,
+        }]
+    except (IndexError, TypeError, ValueError):
+        return None
+
+
+def _part_items(sections: tuple, limit: Optional[int] = None) -> str:
+    partial = f"<0.{limit}>" if limit else ""
+    return "(UID " + " ".join(f"BODY.PEEK[{section}]{partial}" for section in sections) + ")"
+
+
+def _group_by_sections(plans: dict) -> dict[tuple, list[int]]:
+    """同一条 UID FETCH 只能取相同的分段，按所需分段把邮件分组"""
+    groups: dict[tuple, list[int]] = {}
+    for uid, plan in plans.items():
+        if plan is not None:
+            groups.setdefault(tuple(part["section"] for part in plan[0]), []).append(uid)
+    return groups
+
+
+def _submit_text_record(header: dict, plan: tuple[list[dict], list[dict]], fetched: dict) -> Future:
+    """取出头部和正文分段，解码交给进程池"""
+    text_parts, attachments = plan
+    payloads = []
+    for part in text_parts:
+        key = f"BODY[{part['section']}]"
+        data = next((value for name, value in fetched.items() if name == key or name.startswith(key + "<")), None)
+        payloads.append((part, data or b""))
+    return submit_text_record(_header_bytes(header) or b"", payloads, attachments)
+
+
+def build_reply(username: str, to_addr: str, subject: str, body: str) -> MIMEText:
     msg = MIMEText(body, _charset="utf-8")
     msg["Subject"] = subject
     msg["From"] = username
     msg["To"] = to_addr
-
-    server = smtplib.SMTP_SSL(host, port) if use_ssl else smtplib.SMTP(host, port)
-    if not use_ssl:
-        server.starttls()
-
-    try:
-        server.login(username, password)
-        server.sendmail(username, [to_addr], msg.as_string())
-    finally:
-        server.quit()
-    return "OK"
+    return msg
@@ -0,0 +1,136 @@
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 关键词后缀 :数字 表示权重，如 "refund:2"；用双引号包住表示整词匹配，如 "\"ship\""
+_WEIGHT_RE = re.compile(r"^(.*?):(\d+(?:\.\d+)?)$")
+
+
+def parse_keywords(keywords: Optional[str]) -> List[str]:
+    """分类的关键词配置（逗号分隔）转成小写列表"""
+    return [k.strip().lower() for k in (keywords or "").split(",") if k.strip()]
+
+
+def _parse_keyword(keyword: str) -> Optional[Tuple[str, float, bool]]:
+    """返回 (匹配文本, 权重, 是否整词匹配)"""
+    weight = 1.0
+    match = _WEIGHT_RE.match(keyword)
+    if match and match.group(1).strip():
+        keyword, weight = match.group(1).strip(), float(match.group(2))
+    whole_word = len(keyword) > 2 and keyword[0] == keyword[-1] == '"'
+    if whole_word:
+        keyword = keyword[1:-1].strip()
+    if not keyword:
+        return None
+    return keyword.lower(), weight, whole_word
+
+
+def _is_word_char(ch: str) -> bool:
+    # 只对拉丁字母数字判断词边界；中文词之间没有分隔符，整词匹配对中文不生效
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class KeywordMatcher:
+    """
+    把所有分类的关键词编译成一个 Aho-Corasick 自动机，扫描一遍文本即可给所有分类打分。
+    每个分类的得分是命中的不同关键词的权重之和（默认权重 1，即命中个数）。
+    """
+
+    def __init__(self, keyword_lists: List[List[str]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 状态 -> 在该状态结束的关键词 [(长度, [(分类下标, 关键词编号, 权重, 整词), ...])]
+        self._out: List[list] = [[]]
+        self._categories = len(keyword_lists)
+        entries: Dict[str, list] = {}
+        entry_id = 0
+        for index, keywords in enumerate(keyword_lists):
+            for keyword in keywords:
+                parsed = _parse_keyword(keyword)
+                if not parsed:
+                    continue
+                text, weight, whole_word = parsed
+                entries.setdefault(text, []).append((index, entry_id, weight, whole_word))
+                entry_id += 1
+        for text, targets in entries.items():
+            self._add(text, targets)
+        self._build()
+
+    def _add(self, text: str, targets: list) -> None:
+        state = 0
+        for ch in text:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(text), targets))
+
+    def _build(self) -> None:
+        # 按层次遍历设置失败指针，并把失败链上的输出合并进来，扫描时不用再沿失败链收集
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def scores(self, text: str) -> List[float]:
+        """各分类的得分，下标与构造时的分类顺序一致"""
+        lowered = text.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        matched = set()
+        scores = [0.0] * self._categories
+        state = 0
+        for end, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for length, targets in out[state]:
+                for index, entry_id, weight, whole_word in targets:
+                    if entry_id in matched:
+                        continue
+                    if whole_word:
+                        start = end - length + 1
+                        if (start > 0 and _is_word_char(lowered[start - 1])) or (
+                            end + 1 < len(lowered) and _is_word_char(lowered[end + 1])
+                        ):
+                            continue
+                    matched.add(entry_id)
+                    scores[index] += weight
+        return scores
+
+
+_cache_lock = threading.Lock()
+# (分类列表对象, 分类 ID 和关键词, 自动机)；配置缓存中的分类列表不变时直接按对象命中
+_cached: Optional[Tuple[List[Dict], tuple, KeywordMatcher]] = None
+
+
+def matcher_for(categories: List[Dict]) -> KeywordMatcher:
+    """
+    按分类 ID 和关键词缓存编译好的自动机，分类配置变化后才重新编译。
+    来自配置缓存的分类列表在版本不变时是同一个对象，直接命中，不用重新解析关键词。
+    """
+    global _cached
+    cached = _cached
+    if cached is not None and cached[0] is categories:
+        return cached[2]
+    keyword_lists = [
+        cat["keyword_list"] if "keyword_list" in cat else parse_keywords(cat.get("keywords")) for cat in categories
+    ]
+    key = tuple((cat.get("id"), tuple(keywords)) for cat, keywords in zip(categories, keyword_lists))
+    if cached is not None and cached[1] == key:
+        matcher = cached[2]
+    else:
+        matcher = KeywordMatcher(keyword_lists)
+    with _cache_lock:
+        _cached = (categories, key, matcher)
+    return matcher
@@ -0,0 +1,205 @@
+"""
+MIME 解析阶段。
+原始邮件 bytes 在进程池中解析为紧凑的记录（头部、正文、附件元数据），
+头部解码与 base64/quoted-printable 解码可以用满多核，并与网络下载重叠进行。
+"""
+import base64
+import binascii
+import email
+import email.utils
+import logging
+import multiprocessing
+import os
+import quopri
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from email.header import decode_header
+from email.message import Message
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PARSE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _decode_bytes(data: bytes, charset: Optional[str]) -> str:
+    """按声明的字符集解码，字符集未知（如 unknown-8bit）时退回 utf-8"""
+    try:
+        return data.decode(charset or 'utf-8', errors='ignore')
+    except LookupError:
+        return data.decode('utf-8', errors='ignore')
+
+
+def _decode_subject(subject: str) -> str:
+    decoded_parts = decode_header(subject)
+    return ''.join(_decode_bytes(p, e) if isinstance(p, bytes) else p for p, e in decoded_parts)
+
+
+def _decode_sender(sender: str) -> str:
+    """Decode sender field, handling encoded names and email addresses"""
+    if not sender:
+        return ""
+    decoded_parts = decode_header(sender)
+    parts = []
+    for part, encoding in decoded_parts:
+        if isinstance(part, bytes):
+            parts.append(_decode_bytes(part, encoding))
+        else:
+            parts.append(part)
+    return ''.join(parts)
+
+
+def _decode_part(part: Message) -> str:
+    return _decode_bytes(part.get_payload(decode=True) or b"", part.get_content_charset())
+
+
+def _encoded_size(part: Message) -> int:
+    """按传输编码估算附件大小，不解码内容"""
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return 0
+    if (part.get("Content-Transfer-Encoding") or "").strip().lower() == "base64":
+        return len("".join(payload.split())) * 3 // 4
+    return len(payload)
+
+
+def _walk_parts(msg: Message) -> tuple[str, str, list[dict]]:
+    """遍历一次 MIME 树，返回 (text, html, attachments)"""
+    text_parts, html_parts, attachments = [], [], []
+    if not msg.is_multipart():
+        return _decode_part(msg).strip(), "", []
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        ct = part.get_content_type()
+        if part.get("Content-Disposition"):
+            attachments.append({
+                "filename": _decode_subject(part.get_filename() or ""),
+                "content_type": ct,
+                "size": _encoded_size(part),
+            })
+        elif ct == "text/plain":
+            text_parts.append(_decode_part(part))
+        elif ct == "text/html":
+            html_parts.append(_decode_part(part))
+    return '\n'.join(text_parts).strip(), '\n'.join(html_parts).strip(), attachments
+
+
+def _extract_body(msg: Message) -> tuple[str, str]:
+    body_text, body_html, _ = _walk_parts(msg)
+    return body_text, body_html
+
+
+def _parse_date(date_str: str) -> str:
+    """Parse RFC 2822 date string to ISO 8601 format"""
+    if not date_str:
+        return datetime.utcnow().isoformat()
+
+    try:
+        dt = email.utils.parsedate_to_datetime(date_str)
+        return dt.isoformat()
+    except Exception:
+        # Fallback to current time if parsing fails
+        return datetime.utcnow().isoformat()
+
+
+def message_to_dict(msg: Message) -> dict:
+    body_text, body_html, attachments = _walk_parts(msg)
+    return {
+        "message_id": msg.get("Message-ID"),
+        "sender": _decode_sender(msg.get("From", "")),
+        "subject": _decode_subject(msg.get("Subject", "")),
+        "received_at": _parse_date(msg.get("Date")),
+        "body_text": body_text,
+        "body_html": body_html,
+        "attachments": attachments,
+    }
+
+
+def _decode_section(data: bytes, encoding: str, charset: Optional[str]) -> str:
+    """解码单独下载的分段；按字节截断的分段末尾可能不完整，尽量解出前面的内容"""
+    if encoding == "base64":
+        data = b"".join(data.split())
+        data = data[:len(data) // 4 * 4]
+        try:
+            data = base64.b64decode(data)
+        except (binascii.Error, ValueError):
+            data = b""
+    elif encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+    return _decode_bytes(data, charset)
+
+
+def build_text_record(header_raw: bytes, parts: list[tuple[dict, bytes]], attachments: list[dict]) -> dict:
+    """
+    由头部和按 BODYSTRUCTURE 单独下载的正文分段组装记录，字段同 message_to_dict。
+    parts: [(分段信息, 分段内容)]，attachments 只有元数据，内容不下载。
+    """
+    msg = email.message_from_bytes(header_raw)
+    text_parts, html_parts = [], []
+    for info, data in parts:
+        decoded = _decode_section(data, info["encoding"], info.get("charset"))
+        (html_parts if info["subtype"] == "html" else text_parts).append(decoded)
+    return {
+        "message_id": msg.get("Message-ID"),
+        "sender": _decode_sender(msg.get("From", "")),
+        "subject": _decode_subject(msg.get("Subject", "")),
+        "received_at": _parse_date(msg.get("Date")),
+        "body_text": '\n'.join(text_parts).strip(),
+        "body_html": '\n'.join(html_parts).strip(),
+        "attachments": [{**a, "filename": _decode_subject(a["filename"])} for a in attachments],
+    }
+
+
+def parse_message(raw: bytes) -> dict:
+    """解析原始邮件，在进程池 worker 中执行"""
+    return message_to_dict(email.message_from_bytes(raw))
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    with _executor_lock:
+        if _executor is None and PARSE_WORKERS > 1:
+            # spawn：uvicorn 进程里有线程，fork 不安全
+            _executor = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _submit(fn, *args) -> Future:
+    """提交到进程池；单核机器或进程池不可用时在当前线程执行"""
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            return executor.submit(fn, *args)
+        except (BrokenProcessPool, RuntimeError) as e:
+            logger.warning(f"MIME parser pool unavailable, parsing inline: {e}")
+            shutdown()
+    future: Future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def submit_parse(raw: bytes) -> Future:
+    """提交整封邮件的解析任务"""
+    return _submit(parse_message, raw)
+
+
+def submit_text_record(header_raw: bytes, parts: list[tuple[dict, bytes]], attachments: list[dict]) -> Future:
+    """提交 build_text_record 任务，头部和正文分段的解码同样不占用调用线程（事件循环）"""
+    return _submit(build_text_record, header_raw, parts, attachments)
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
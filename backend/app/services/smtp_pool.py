@@ -0,0 +1,171 @@
+import logging
+import smtplib
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from .email_client import build_reply
+
+logger = logging.getLogger(__name__)
+
+# 会话闲置超过该时长后不再复用（多数服务器几分钟不发命令就断开）
+SMTP_SESSION_MAX_IDLE = 60
+SMTP_TIMEOUT = 30
+
+# (to_addr, subject, body)
+Outgoing = Tuple[str, str, str]
+
+
+def _is_connection_error(e: Exception) -> bool:
+    """连接已断开或服务器要求断开（421），重连后可重试"""
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code == 421:
+        return True
+    # SMTPException 是 OSError 的子类，收件人被拒、5xx、认证失败等不是连接问题
+    return isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+
+
+class _Session:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.server: Optional[smtplib.SMTP] = None
+        self.last_used = 0.0
+
+    def discard(self) -> None:
+        if self.server:
+            try:
+                self.server.quit()
+            except Exception:
+                self.server.close()
+            self.server = None
+
+
+class _RateLimiter:
+    """按服务商限制发送速率，同一服务商的所有账号共享"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._limits: Dict[str, float] = {}
+        self._next_at: Dict[str, float] = {}
+
+    def configure(self, limits: Dict[str, float]) -> None:
+        """limits: {smtp_host: 每分钟最多发送封数}，0 或未配置表示不限"""
+        with self._lock:
+            self._limits = {host.lower(): float(n) for host, n in limits.items() if n and float(n) > 0}
+
+    def wait(self, host: str) -> None:
+        host = host.lower()
+        with self._lock:
+            per_minute = self._limits.get(host)
+            if not per_minute:
+                return
+            now = time.monotonic()
+            at = max(now, self._next_at.get(host, 0.0))
+            self._next_at[host] = at + 60.0 / per_minute
+        if at > now:
+            time.sleep(at - now)
+
+
+class SMTPConnectionPool:
+    """
+    进程级 SMTP 连接池。
+    按账号保持已登录的连接，多封邮件复用同一会话，省去每封一次的 TLS 握手和登录；
+    复用前用 NOOP 校验，遇到 421 或 socket 错误时重连并重试该封一次。
+    同一账号的会话同一时间只给一个调用方使用。
+    """
+
+    def __init__(self, max_idle: float = SMTP_SESSION_MAX_IDLE) -> None:
+        self.max_idle = max_idle
+        self.rate_limiter = _RateLimiter()
+        self._sessions: Dict[tuple, _Session] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple) -> _Session:
+        with self._lock:
+            return self._sessions.setdefault(key, _Session())
+
+    def _validate(self, session: _Session) -> bool:
+        if time.monotonic() - session.last_used > self.max_idle:
+            session.discard()
+            return False
+        try:
+            if session.server.noop()[0] == 250:
+                return True
+        except Exception as e:
+            logger.info(f"Dropping stale SMTP session: {e}")
+        session.discard()
+        return False
+
+    @staticmethod
+    def _connect(host: str, port: int, username: str, password: str, use_ssl: bool) -> smtplib.SMTP:
+        server = smtplib.SMTP_SSL(host, port, timeout=SMTP_TIMEOUT) if use_ssl else smtplib.SMTP(host, port, timeout=SMTP_TIMEOUT)
+        try:
+            if not use_ssl:
+                server.starttls()
+            server.login(username, password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def send_batch(
+        self,
+        host: str,
+        port: int,
+        username: str,
+        password: str,
+        use_ssl: bool,
+        messages: List[Outgoing],
+    ) -> List[Union[str, Exception]]:
+        """
+        在该账号的会话上依次发送多封邮件。
+        返回与 messages 一一对应的结果："OK" 或发送该封时的异常；单封失败不影响其余邮件。
+        """
+        session = self._get((host, port, username, password, bool(use_ssl)))
+        results: List[Union[str, Exception]] = []
+        with session.lock:
+            for to_addr, subject, body in messages:
+                msg = build_reply(username, to_addr, subject, body).as_string()
+                for attempt in range(2):
+                    self.rate_limiter.wait(host)
+                    try:
+                        if session.server is None or not self._validate(session):
+                            session.server = self._connect(host, port, username, password, use_ssl)
+                        session.server.sendmail(username, [to_addr], msg)
+                    except Exception as e:
+                        if _is_connection_error(e):
+                            session.discard()
+                            if attempt == 0:
+                                logger.warning(f"SMTP session lost ({e}), reconnecting")
+                                continue
+                        else:
+                            # 收件人被拒等单封错误，连接仍可用，重置事务后继续发送下一封
+                            self._reset(session)
+                            session.last_used = time.monotonic()
+                        results.append(e)
+                        break
+                    session.last_used = time.monotonic()
+                    results.append("OK")
+                    break
+        return results
+
+    @staticmethod
+    def _reset(session: _Session) -> None:
+        if session.server is None:
+            return
+        try:
+            session.server.rset()
+        except Exception:
+            session.discard()
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.discard()
+
+
+smtp_pool = SMTPConnectionPool()
@@ -16,7 +16,7 @@ if str(backend_path) not in sys.path:
 
 try:
     from app.db import db
-    from app.services.email_client import send_reply
+    from app.services.smtp_pool import smtp_pool
 except ImportError:
     # 如果添加路径后仍然导入失败，使用相对导入
     pass
@@ -284,52 +284,46 @@ def generateTestEmails(
     if target_email.lower() != allowed_email.lower():
         return {"success": False, "error": f"Only {allowed_email} is allowed for testing"}
 
-    results = []
-    success_count = 0
-
-    for i in range(count):
-        # 随机选择邮件类型
+    # 生成邮件内容
+    contents = []
+    for _ in range(count):
         email_type = random.choice(email_types)
+        contents.append((email_type, generate_email_content(email_type)))
+
+    # 所有邮件复用同一个 SMTP 会话发送，速率由连接池按服务商限制
+    responses = smtp_pool.send_batch(
+        host=smtp_config["host"],
+        port=smtp_config["port"],
+        username=smtp_config["username"],
+        password=smtp_config["password"],
+        use_ssl=smtp_config["use_ssl"],
+        messages=[(target_email, content["subject"], content["body"]) for _, content in contents],
+    )
 
-        try:
-            # 生成邮件内容
-            email_content = generate_email_content(email_type)
-
-            # 发送邮件
-            response = send_reply(
-                host=smtp_config["host"],
-                port=smtp_config["port"],
-                username=smtp_config["username"],
-                password=smtp_config["password"],
-                to_addr=target_email,
-                subject=email_content["subject"],
-                body=email_content["body"],
-                use_ssl=smtp_config["use_ssl"]
-            )
-
-            results.append({
-                "index": i + 1,
-                "type": email_type,
-                "subject": email_content["subject"],
-                "sender": email_content["sender_name"],
-                "order_number": email_content["order_number"],
-                "status": "sent" if response == "OK" else "failed"
-            })
-
-            if response == "OK":
-                success_count += 1
-
-            # 添加小延迟避免过快发送
-            import time
-            time.sleep(0.5)
+    results = []
+    success_count = 0
 
-        except Exception as e:
+    for i, ((email_type, email_content), response) in enumerate(zip(contents, responses)):
+        if isinstance(response, Exception):
             results.append({
                 "index": i + 1,
                 "type": email_type,
                 "status": "error",
-                "error": str(e)
+                "error": str(response)
             })
+            continue
+
+        results.append({
+            "index": i + 1,
+            "type": email_type,
+            "subject": email_content["subject"],
+            "sender": email_content["sender_name"],
+            "order_number": email_content["order_number"],
+            "status": "sent" if response == "OK" else "failed"
+        })
+
+        if response == "OK":
+            success_count += 1
 
     return {
         "success": success_count > 0,
@@ -1,6 +1,10 @@
+import multiprocessing
+
 import uvicorn
 
 if __name__ == "__main__":
+    # 打包后的可执行文件中，MIME 解析进程池需要 freeze_support
+    multiprocessing.freeze_support()
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
@@ -2,6 +2,9 @@ import React, { useEffect, useMemo, useState } from "react";
 import Button from "./components/Button";
 
 const apiBase = "/api";
+// 发信后轮询投递状态的间隔（毫秒）和最大次数
+const DELIVERY_POLL_INTERVAL = 2000;
+const DELIVERY_POLL_LIMIT = 60;
 
 // 时间格式化工具函数
 const formatRelativeTime = (dateString) => {
@@ -73,7 +76,7 @@ export default function App() {
   const [templates, setTemplates] = useState([]);
   const [settings, setSettings] = useState(emptySettings);
   const [mailAccount, setMailAccount] = useState(null);
-  const [processingStatus, setProcessingStatus] = useState({}); // { id: 'analyzing' | 'sending' | 'sent' | 'deleting' }
+  const [processingStatus, setProcessingStatus] = useState({}); // { id: 'analyzing' | 'sending' | 'queued' | 'sent' | 'failed' | 'deleting' }
   const [processingSuccess, setProcessingSuccess] = useState(false);
   const [isLoading, setIsLoading] = useState(true);
 
@@ -155,10 +158,17 @@ export default function App() {
     setEmailTotalCount(data.total_count || 0);
     setEmailPendingCount(data.pending_count || 0);
     if ((data.data || []).length && !selectedEmail) {
-      setSelectedEmail(data.data[0]);
+      setSelectedEmail(await loadEmailDetail(data.data[0]));
     }
   };
 
+  // 列表只返回摘要字段，正文、译文和回复从详情接口获取
+  const loadEmailDetail = async (email) => {
+    const response = await fetch(`${apiBase}/emails/${email.id}`);
+    if (!response.ok) return email;
+    return response.json();
+  };
+
   const loadProcessedEmails = async (page = 1) => {
     const response = await fetch(`${apiBase}/emails?status=sent&page=${page}&page_size=${processedPageSize}`);
     const data = await response.json();
@@ -187,14 +197,27 @@ export default function App() {
     setMailAccount(data.mail_account);
   };
 
-  const selectEmail = (email) => {
+  const selectEmail = async (email) => {
     setSelectedEmail(email);
     setAnalysis(null);
-    setReply(email.final_reply || email.ai_reply || "");
+    setReply("");
     setReplyTranslation("");
     setProcessingSuccess(false);
     setSelectedTemplateId(null);
     setView("workspace");
+    const detail = await loadEmailDetail(email);
+    setSelectedEmail(current => (current?.id === detail.id ? detail : current));
+    setReply(detail.final_reply || detail.ai_reply || "");
+  };
+
+  const toggleProcessedEmail = async (email) => {
+    if (selectedProcessedEmail?.id === email.id) {
+      setSelectedProcessedEmail(null);
+      return;
+    }
+    setSelectedProcessedEmail(email);
+    const detail = await loadEmailDetail(email);
+    setSelectedProcessedEmail(current => (current?.id === detail.id ? detail : current));
   };
 
   const runAnalysis = async () => {
@@ -331,25 +354,57 @@ export default function App() {
     }
   };
 
+  // 轮询投递状态，直到后台发信成功或失败
+  const pollDelivery = async (emailId) => {
+    for (let i = 0; i < DELIVERY_POLL_LIMIT; i++) {
+      await new Promise(resolve => setTimeout(resolve, DELIVERY_POLL_INTERVAL));
+      try {
+        const response = await fetch(`${apiBase}/emails/${emailId}/delivery`);
+        if (!response.ok) continue;
+        const delivery = await response.json();
+        if (delivery.status === "sent") {
+          setProcessingStatus(prev => ({ ...prev, [emailId]: "sent" }));
+          return;
+        }
+        if (delivery.status === "failed") {
+          setProcessingStatus(prev => ({ ...prev, [emailId]: "failed" }));
+          alert(`发送失败：${delivery.last_error || "未知错误"}`);
+          await loadEmails();
+          return;
+        }
+      } catch (e) {
+        // 网络抖动时继续下一次轮询
+      }
+    }
+  };
+
   const sendEmail = async () => {
     if (!selectedEmail) return;
-    setProcessingStatus(prev => ({ ...prev, [selectedEmail.id]: "sending" }));
+    const emailId = selectedEmail.id;
+    setProcessingStatus(prev => ({ ...prev, [emailId]: "sending" }));
     try {
-      await fetch(`${apiBase}/emails/${selectedEmail.id}/send`, {
+      const response = await fetch(`${apiBase}/emails/${emailId}/send`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ reply, category_id: analysis?.category?.id })
       });
-      
-      setProcessingStatus(prev => ({ ...prev, [selectedEmail.id]: "sent" }));
+      if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(error.detail || `HTTP ${response.status}`);
+      }
+
+      // 接口只负责入队，真正的投递结果要轮询 /delivery
+      setProcessingStatus(prev => ({ ...prev, [emailId]: "queued" }));
       setProcessingSuccess(true);
       await loadEmails();
+      pollDelivery(emailId);
     } catch (e) {
       setProcessingStatus(prev => {
         const next = { ...prev };
-        delete next[selectedEmail.id];
+        delete next[emailId];
         return next;
       });
+      alert(`发送失败：${e.message}`);
     }
   };
 
@@ -367,20 +422,30 @@ export default function App() {
     event.preventDefault();
     setIsSavingSettings(true);
     try {
-      await fetch(`${apiBase}/settings`, {
+      const response = await fetch(`${apiBase}/settings`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify(settings)
       });
+      if (!response.ok) {
+        const error = await response.json().catch(() => ({}));
+        throw new Error(typeof error.detail === "string" ? error.detail : `HTTP ${response.status}`);
+      }
       if (mailAccount) {
-        await fetch(`${apiBase}/settings/mail-account`, {
+        const accountResponse = await fetch(`${apiBase}/settings/mail-account`, {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify(mailAccount)
         });
+        if (!accountResponse.ok) {
+          const error = await accountResponse.json().catch(() => ({}));
+          throw new Error(typeof error.detail === "string" ? error.detail : `HTTP ${accountResponse.status}`);
+        }
       }
       await loadSettings();
       setShowWizard(false);
+    } catch (e) {
+      alert(`保存失败：${e.message}`);
     } finally {
       setIsSavingSettings(false);
     }
@@ -605,7 +670,9 @@ export default function App() {
                           <span className={`status-pill ${status}`}>
                             {status === "analyzing" && "分析中"}
                             {status === "sending" && "发送中"}
+                            {status === "queued" && "已排队"}
                             {status === "sent" && "已发送"}
+                            {status === "failed" && "发送失败"}
                             {status === "deleting" && "删除中"}
                           </span>
                         )}
@@ -744,7 +811,7 @@ export default function App() {
                     <h4>AI 推荐</h4>
                     <p>建议分类：{analysis?.category?.name || activeCategoryName}</p>
                     <p>置信度：{analysis?.confidence ? analysis.confidence.toFixed(2) : "-"}</p>
-                    <p>匹配方式：{analysis?.method === "keyword" ? "关键词" : analysis?.method === "ai" ? "AI语义" : analysis?.method === "default" ? "默认" : "-"}</p>
+                    <p>匹配方式：{analysis?.method === "keyword" ? "关键词" : analysis?.method === "local" ? "本地模型" : analysis?.method === "ai" ? "AI语义" : analysis?.method === "default" ? "默认" : "-"}</p>
                     {analysis?.reason && <p>分类原因：{analysis.reason}</p>}
                     <div className="reply-source-badge">
                       {analysis?.reply_source === "template" && <span className="badge template">来自模板</span>}
@@ -984,8 +1051,8 @@ export default function App() {
                     role="button"
                     tabIndex={0}
                     className={`mail-card archive-card ${selectedProcessedEmail?.id === email.id ? "selected" : ""}`}
-                    onClick={() => setSelectedProcessedEmail(selectedProcessedEmail?.id === email.id ? null : email)}
-                    onKeyDown={(e) => { if (e.key === 'Enter') setSelectedProcessedEmail(selectedProcessedEmail?.id === email.id ? null : email); }}
+                    onClick={() => toggleProcessedEmail(email)}
+                    onKeyDown={(e) => { if (e.key === 'Enter') toggleProcessedEmail(email); }}
                     style={{ animationDelay: `${index * 0.05}s` }}
                   >
                     <div className="archive-timeline">
@@ -1006,15 +1073,15 @@ export default function App() {
                         <div className="archive-details">
                           <div className="detail-section">
                             <h4>原文内容</h4>
-                            <p>{email.body_text || "(空)"}</p>
+                            <p>{selectedProcessedEmail.body_text || "(空)"}</p>
                           </div>
                           <div className="detail-section">
                             <h4>译文</h4>
-                            <p>{email.translation || "未翻译"}</p>
+                            <p>{selectedProcessedEmail.translation || "未翻译"}</p>
                           </div>
                           <div className="detail-section">
                             <h4>回复内容</h4>
-                            <p className="reply-content">{email.final_reply || email.ai_reply || "(无)"}</p>
+                            <p className="reply-content">{selectedProcessedEmail.final_reply || selectedProcessedEmail.ai_reply || "(无)"}</p>
                           </div>
                         </div>
                       )}